@@ -121,29 +121,585 @@
 # division is a constant fraction of the total work done, this would give a
 # net runtime of O(4^a lg^2 b).
 
+# In practice, though, most of that work isn't in the divisions at all, but in
+# the Fraction arithmetic.  Each subtraction builds a new Fraction, which means
+# computing a gcd of two huge numbers to put it in lowest terms.  We can avoid
+# all of this by working with the numerator and denominator as plain integers.
+# Notice that the unit fraction we subtract depends only on the value of a / b
+# and not on how it's written, so we never need to reduce the fraction at all.
+# Writing k = ceil(b / a), which is -(-b // a) in integer arithmetic, the next
+# fraction is (ak - b) / bk, and ak - b is just (-b) mod a.  We stop once a
+# divides b, at which point what's left is the unit fraction 1 / (b / a).
+# (Without reducing, the numerator and denominator may share a common factor,
+# but any such factor divides the numerator and so is less than a.  The
+# denominators are therefore only a few bits longer than the reduced ones.)
+
+import binascii
+from collections import OrderedDict
 from fractions import Fraction
+import multiprocessing
+import time
+
+try:
+    from math import gcd
+except ImportError:
+    from fractions import gcd
 
 def greedyEgyptianFraction(rational):
     # Sanity check: the rational number should be in the range (0, 1)
     if rational <= 0 or rational >= 1:
         raise Exception("Rational number out of range" , rational)
 
-    # Create a list to store the Egyptian fraction representation.
-    result = []
+    # Expand the fraction, then turn each denominator back into a unit
+    # fraction.
+    return [Fraction(1, denominator) for denominator in
+            greedyEgyptianDenominators(rational.numerator,
+                                       rational.denominator)]
+
+# Function: greedyEgyptianDenominators(numerator, denominator)
+# Usage: for k in greedyEgyptianDenominators(42, 137): ...
+# -----------------------------------------------------------------------------
+# Given the numerator and denominator of a fraction in the range (0, 1), which
+# needn't be in lowest terms, returns a generator that lazily yields the
+# denominators of the unit fractions in its greedy Egyptian fraction expansion,
+# in increasing order.  All arithmetic is done on integers.
+def greedyEgyptianDenominators(numerator, denominator):
+    # Sanity check: the rational number should be in the range (0, 1).  We do
+    # this here rather than in the generator so that the error is raised
+    # right away rather than on the first call to next.
+    if numerator <= 0 or denominator <= numerator:
+        raise Exception("Rational number out of range",
+                        Fraction(numerator, denominator))
 
-    # Now, iteratively subtract out the largest unit fraction that may be
-    # subtracted out until we arrive at a unit fraction.
-    while True:
-        # If the rational number has numerator 1, we're done.
-        if rational.numerator == 1:
-            result.append(rational)
-            return result
+    return greedyDenominators(numerator, denominator)
 
-        # Otherwise, find the largest unit fraction less than the current
-        # rational number.  This is given by the ceiling of the denominator
-        # divided by the numerator
-        unitFraction = Fraction(1, rational.denominator / rational.numerator + 1)
-        result.append(unitFraction)
+# Function: greedyDenominators(numerator, denominator)
+# Usage: for k in greedyDenominators(42, 137): ...
+# -----------------------------------------------------------------------------
+# The generator behind greedyEgyptianDenominators, which assumes that its input
+# has already been checked.
+def greedyDenominators(numerator, denominator):
+    # Iteratively subtract out the largest unit fraction that may be subtracted
+    # out until we arrive at a unit fraction.
+    while denominator % numerator != 0:
+        # The largest unit fraction less than the current rational number is
+        # given by the ceiling of the denominator divided by the numerator.
+        k = -(-denominator // numerator)
+        yield k
 
         # Subtract out this unit fraction.
-        rational = rational - unitFraction
+        numerator, denominator = (-denominator) % numerator, denominator * k
+
+    # What's left is a unit fraction.
+    yield denominator // numerator
+
+# The greedy algorithm is simple, but as we saw above its denominators can
+# grow doubly-exponentially, and there are other algorithms that keep them
+# much smaller.  Each of the functions below takes the numerator and
+# denominator of a fraction a / b in the range (0, 1) and yields the
+# denominators of an Egyptian fraction for it.
+#
+# Golomb's method starts from the observation that if p is the inverse of a
+# modulo b (so that ap = 1 + bc for some c < a), then
+#
+#                     a      ap      1 + bc      1       c
+#                    --- = ----- = -------- = ----- + ---
+#                     b      bp       bp        bp     p
+#
+# Since c < a, we can repeat this on c / p until the numerator reaches one.
+# Every denominator after the first is less than p(p - 1) < bp, so none of
+# them is repeated, and none is larger than b(b - 1).
+#
+# The binary remainder method picks the smallest power of two N >= b and
+# writes aN = qb + r, so that a / b = q / N + r / bN.  Writing q and r in
+# binary splits each of these into distinct unit fractions: q / N becomes a sum
+# of fractions 1 / (N / 2^i), and r / bN a sum of fractions 1 / (bN / 2^i).
+# The first group are all powers of two no larger than N, and the second are
+# all larger than N, so there are no duplicates.  This uses O(log b) terms, and
+# no denominator is larger than bN < 2b^2.
+#
+# Finally, we can simply search for the best expansion.  If a / b is the sum of
+# t distinct unit fractions, the largest of which is 1 / x, then 1 / x < a / b
+# (unless t = 1) and a / b < t / x, so b / a < x < tb / a.  Trying each such x
+# in turn and recursively expanding a / b - 1 / x into t - 1 unit fractions
+# smaller than 1 / x finds every expansion into t terms.  This takes
+# exponential time in general, so the search is bounded by a number of terms
+# and a time limit, and is seeded with the best of the expansions above so
+# that it has something to hand back if it runs out of time.
+
+# Function: golombDenominators(numerator, denominator)
+# Usage: for k in golombDenominators(42, 137): ...
+# -----------------------------------------------------------------------------
+# Yields the denominators of the Egyptian fraction for numerator / denominator
+# found by Golomb's method, in decreasing order.
+def golombDenominators(numerator, denominator):
+    divisor = gcd(numerator, denominator)
+    numerator, denominator = numerator // divisor, denominator // divisor
+
+    while numerator != 1:
+        inverse = modularInverse(numerator, denominator)
+        yield denominator * inverse
+        numerator, denominator = ((numerator * inverse - 1) // denominator,
+                                  inverse)
+    yield denominator
+
+# Function: modularInverse(value, modulus)
+# Usage: p = modularInverse(42, 137)
+# -----------------------------------------------------------------------------
+# Returns the p in the range [0, modulus) with value * p = 1 (mod modulus),
+# using the extended Euclidean algorithm.  The value and modulus must be
+# coprime.
+def modularInverse(value, modulus):
+    # Maintain the invariant that lhs = lhsCoefficient * value (mod modulus),
+    # and similarly for rhs.
+    lhs, lhsCoefficient = modulus, 0
+    rhs, rhsCoefficient = value % modulus, 1
+    while rhs != 0:
+        quotient = lhs // rhs
+        lhs, rhs = rhs, lhs - quotient * rhs
+        lhsCoefficient, rhsCoefficient = (rhsCoefficient,
+                                          lhsCoefficient -
+                                          quotient * rhsCoefficient)
+
+    assert lhs == 1
+    return lhsCoefficient % modulus
+
+# Function: binaryRemainderDenominators(numerator, denominator)
+# Usage: for k in binaryRemainderDenominators(42, 137): ...
+# -----------------------------------------------------------------------------
+# Yields the denominators of the Egyptian fraction for numerator / denominator
+# found by the binary remainder method, in increasing order.
+def binaryRemainderDenominators(numerator, denominator):
+    divisor = gcd(numerator, denominator)
+    numerator, denominator = numerator // divisor, denominator // divisor
+
+    power = 1 << (denominator - 1).bit_length()
+    quotient, remainder = divmod(numerator * power, denominator)
+    for bits, scale in ((quotient, power), (remainder, denominator * power)):
+        for i in range(bits.bit_length() - 1, -1, -1):
+            if bits >> i & 1:
+                yield scale >> i
+
+# Function: searchDenominators(numerator, denominator, objective, maxTerms,
+#                              deadline)
+# Usage: terms = searchDenominators(42, 137, "shortest", 5, None)
+# -----------------------------------------------------------------------------
+# Searches for the best Egyptian fraction for numerator / denominator with at
+# most maxTerms terms, returning its denominators in increasing order.  If the
+# objective is "shortest," the best expansion is the one with the fewest terms
+# (and then the smallest largest denominator); if it is "smallest," it is the
+# one with the smallest largest denominator (and then the fewest terms).  If
+# maxTerms is None, the search only considers expansions as short as the best
+# of the greedy, Golomb, and binary remainder expansions.  If the time.time()
+# deadline passes before the search is done, the best expansion found so far
+# is returned instead.
+def searchDenominators(numerator, denominator, objective, maxTerms, deadline):
+    divisor = gcd(numerator, denominator)
+    numerator, denominator = numerator // divisor, denominator // divisor
+
+    if objective == "shortest":
+        key = lambda terms: (len(terms), terms[-1])
+    elif objective == "smallest":
+        key = lambda terms: (terms[-1], len(terms))
+    else:
+        raise Exception("Unknown search objective", objective)
+
+    # Seed the search with the best of the direct methods that fits within the
+    # budgets.
+    best = None
+    for method in (greedyDenominators, golombDenominators,
+                   binaryRemainderDenominators):
+        terms = []
+        for term in method(numerator, denominator):
+            terms.append(term)
+            if (maxTerms is not None and len(terms) > maxTerms) or \
+                    (deadline is not None and time.time() > deadline):
+                break
+        else:
+            terms.sort()
+            if best is None or key(terms) < key(best):
+                best = terms
+
+    if maxTerms is None:
+        maxTerms = 0 if best is None else len(best)
+
+    # Try each number of terms in turn, looking for an expansion whose largest
+    # denominator beats the best one we have.  If we want the shortest
+    # expansion, we can stop as soon as we have one with the current number of
+    # terms.
+    try:
+        for length in range(1, maxTerms + 1):
+            if objective == "shortest" and best is not None and \
+                    len(best) < length:
+                break
+
+            limit = None
+            if best is not None and (objective == "smallest" or
+                                     len(best) == length):
+                limit = best[-1]
+
+            terms = searchTerms(numerator, denominator, length, 1, limit,
+                                deadline)
+            if terms is not None:
+                best = terms
+    except SearchTimeout:
+        pass
+
+    if best is None:
+        raise Exception("No expansion within budget",
+                        Fraction(numerator, denominator))
+    return best
+
+# Function: searchTerms(numerator, denominator, length, minimum, limit,
+#                       deadline)
+# Usage: terms = searchTerms(42, 137, 4, 1, None, None)
+# -----------------------------------------------------------------------------
+# Finds the expansion of numerator / denominator into exactly 'length'
+# distinct unit fractions, with every denominator at least 'minimum' and less
+# than 'limit' (if it isn't None), whose largest denominator is as small as
+# possible.  Returns the denominators in increasing order, or None if there is
+# no such expansion.  Raises SearchTimeout if the time.time() deadline passes.
+def searchTerms(numerator, denominator, length, minimum, limit, deadline):
+    if length == 1:
+        if denominator % numerator != 0:
+            return None
+        term = denominator // numerator
+        if term < minimum or (limit is not None and term >= limit):
+            return None
+        return [term]
+
+    # The first term 1 / x must be smaller than the fraction, and the fraction
+    # smaller than length / x.  Every later term is larger than x, so x must
+    # also be less than limit - length + 1.
+    low = max(minimum, denominator // numerator + 1)
+    high = (length * denominator - 1) // numerator
+
+    # If there is a limit, each of the other length - 1 terms is at least
+    # 1 / (limit - 1), so 1 / x can be at most a / b - (length - 1) /
+    # (limit - 1).  That's a lower bound on x.
+    if limit is not None:
+        slack = numerator * (limit - 1) - denominator * (length - 1)
+        if slack <= 0:
+            return None
+        low = max(low, -(-denominator * (limit - 1) // slack))
+    best = None
+    x = low
+    while x <= high and (limit is None or x <= limit - length):
+        if deadline is not None and time.time() > deadline:
+            raise SearchTimeout()
+
+        remainderNumerator = numerator * x - denominator
+        remainderDenominator = denominator * x
+        divisor = gcd(remainderNumerator, remainderDenominator)
+        terms = searchTerms(remainderNumerator // divisor,
+                            remainderDenominator // divisor,
+                            length - 1, x + 1, limit, deadline)
+
+        # Every expansion we find from here on has to beat this one.
+        if terms is not None:
+            best = [x] + terms
+            limit = terms[-1]
+        x = x + 1
+
+    return best
+
+# Exception: SearchTimeout
+# -----------------------------------------------------------------------------
+# Raised by searchTerms to unwind the search when it runs out of time.
+class SearchTimeout(Exception):
+    pass
+
+# The strategies accepted by egyptianFraction.  Each direct strategy maps to a
+# function yielding the denominators for a fraction in the range (0, 1); the
+# search strategies map to None and are handled by searchDenominators.
+STRATEGIES = {
+    "greedy": greedyDenominators,
+    "golomb": golombDenominators,
+    "binary": binaryRemainderDenominators,
+    "shortest": None,
+    "smallest": None,
+}
+
+# Function: egyptianFraction(rational, strategy = "greedy", maxTerms = None,
+#                            timeLimit = None)
+# Usage: terms = egyptianFraction(Fraction(42, 137), "smallest", 6, 1.0)
+# -----------------------------------------------------------------------------
+# Returns an Egyptian fraction for a rational number in the range (0, 1), as a
+# list of unit fractions from largest to smallest, using the given strategy
+# (one of the keys of STRATEGIES).  'maxTerms' and 'timeLimit' (in seconds)
+# bound the work done.  The direct strategies raise an Exception if they
+# exceed either budget.  The search strategies only look at expansions with at
+# most maxTerms terms, and hand back the best they've found when the time runs
+# out.
+def egyptianFraction(rational, strategy = "greedy", maxTerms = None,
+                     timeLimit = None):
+    return [Fraction(1, denominator) for denominator in
+            egyptianDenominators(rational.numerator, rational.denominator,
+                                 strategy, maxTerms, timeLimit)]
+
+# Function: egyptianDenominators(numerator, denominator, strategy = "greedy",
+#                                maxTerms = None, timeLimit = None)
+# Usage: terms = egyptianDenominators(42, 137, "binary")
+# -----------------------------------------------------------------------------
+# Like egyptianFraction, but takes the numerator and denominator separately
+# and returns the list of denominators in increasing order.
+def egyptianDenominators(numerator, denominator, strategy = "greedy",
+                         maxTerms = None, timeLimit = None):
+    if numerator <= 0 or denominator <= numerator:
+        raise Exception("Rational number out of range",
+                        Fraction(numerator, denominator))
+    if strategy not in STRATEGIES:
+        raise Exception("Unknown strategy", strategy)
+
+    deadline = None if timeLimit is None else time.time() + timeLimit
+    method = STRATEGIES[strategy]
+    if method is None:
+        return searchDenominators(numerator, denominator, strategy, maxTerms,
+                                  deadline)
+
+    terms = []
+    for term in method(numerator, denominator):
+        terms.append(term)
+        if maxTerms is not None and len(terms) > maxTerms:
+            raise Exception("Term budget exceeded",
+                            Fraction(numerator, denominator))
+        if deadline is not None and time.time() > deadline:
+            raise Exception("Time budget exceeded",
+                            Fraction(numerator, denominator))
+
+    terms.sort()
+    return terms
+
+# When expanding many fractions at once, the same remainders tend to come up
+# over and over.  For example, expanding every k / n for a fixed n passes
+# through many of the same fractions with denominators that are multiples of
+# n.  Since the greedy expansion of a fraction is its first term followed by
+# the greedy expansion of what's left, once we've expanded some remainder we
+# can reuse its expansion as the tail of any later expansion that reaches it.
+# An ExpansionCache remembers the expansions of the (reduced) remainders it
+# has seen, up to a fixed number of them, evicting the least recently used
+# when it fills up.  It keeps track of how often it finds what it's looking
+# for, which gives a way to pick a good size for it.
+class ExpansionCache:
+    def __init__(self, maxSize = 4096):
+        """Creates an empty cache holding the expansions of up to maxSize
+        remainders.  A cache of size zero remembers nothing, but still
+        counts its lookups."""
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+
+        # Maps each (numerator, denominator) pair in lowest terms to the tuple
+        # of denominators in its greedy expansion, from least to most recently
+        # used.
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        """Returns the number of remainders in the cache."""
+        return len(self.entries)
+
+    def hitRate(self):
+        """Returns the fraction of lookups that found their remainder in the
+        cache, or zero if there haven't been any lookups."""
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def expand(self, numerator, denominator):
+        """Returns the denominators of the greedy Egyptian fraction for
+        numerator / denominator, which must be in the range (0, 1), as a
+        list in increasing order."""
+
+        if numerator <= 0 or denominator <= numerator:
+            raise Exception("Rational number out of range",
+                            Fraction(numerator, denominator))
+
+        divisor = gcd(numerator, denominator)
+        numerator, denominator = numerator // divisor, denominator // divisor
+
+        # Run the greedy algorithm until we reach either a unit fraction or a
+        # remainder that we've already expanded, remembering each remainder we
+        # pass through along with the term we subtracted from it.
+        path = []
+        while True:
+            if numerator == 1:
+                tail = (denominator,)
+                break
+
+            key = (numerator, denominator)
+            try:
+                tail = self.entries.pop(key)
+                self.entries[key] = tail
+                self.hits = self.hits + 1
+                break
+            except KeyError:
+                self.misses = self.misses + 1
+
+            k = -(-denominator // numerator)
+            path.append((key, k))
+            numerator, denominator = (numerator * k - denominator,
+                                      denominator * k)
+            divisor = gcd(numerator, denominator)
+            numerator, denominator = (numerator // divisor,
+                                      denominator // divisor)
+
+        # Now work back along the path, caching the expansion of each
+        # remainder, which is its own term followed by the expansion of the
+        # next one.
+        for key, k in reversed(path):
+            tail = (k,) + tail
+            if self.maxSize <= 0:
+                continue
+            if len(self.entries) >= self.maxSize:
+                self.entries.popitem(last = False)
+            self.entries[key] = tail
+
+        return list(tail)
+
+# Function: egyptianDenominatorsMany(rationals, cache = None, processes = 1)
+# Usage: expansions = egyptianDenominatorsMany(Fraction(k, 137)
+#                                              for k in range(1, 137))
+# -----------------------------------------------------------------------------
+# Given an iterable of rational numbers in the range (0, 1), returns a list
+# holding the denominators of the greedy Egyptian fraction for each of them, in
+# the same order.  The expansions are memoized in the given ExpansionCache (or
+# in a fresh one), which may be kept around from one batch to the next.
+#
+# If 'processes' isn't 1, the batch is split into contiguous chunks which are
+# farmed out to a pool of that many worker processes (or one per CPU, if it is
+# None).  Each worker memoizes its chunks in a cache of its own of the same
+# size, and their hits and misses are added to the given cache's counts, but
+# their entries are not.
+def egyptianDenominatorsMany(rationals, cache = None, processes = 1):
+    if cache is None:
+        cache = ExpansionCache()
+    fractions = [(rational.numerator, rational.denominator)
+                 for rational in rationals]
+
+    if processes == 1 or len(fractions) <= 1:
+        return [cache.expand(numerator, denominator)
+                for numerator, denominator in fractions]
+
+    # Use several chunks per process so that the pool stays busy.
+    workers = processes or multiprocessing.cpu_count()
+    chunkSize = -(-len(fractions) // (4 * workers))
+    chunks = [(fractions[start : start + chunkSize], cache.maxSize)
+              for start in range(0, len(fractions), chunkSize)]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(expandChunk, chunks)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    expansions = []
+    for chunkExpansions, hits, misses in results:
+        expansions.extend(chunkExpansions)
+        cache.hits = cache.hits + hits
+        cache.misses = cache.misses + misses
+    return expansions
+
+# Function: expandChunk(chunk)
+# Usage: expansions, hits, misses = expandChunk(([(1, 2), (2, 3)], 4096))
+# -----------------------------------------------------------------------------
+# The worker half of egyptianDenominatorsMany.  Given a list of (numerator,
+# denominator) pairs and a cache size, expands each of them through a fresh
+# cache of that size, returning the expansions along with the cache's hit and
+# miss counts.
+def expandChunk(chunk):
+    fractions, maxSize = chunk
+    cache = ExpansionCache(maxSize)
+    expansions = [cache.expand(numerator, denominator)
+                  for numerator, denominator in fractions]
+    return expansions, cache.hits, cache.misses
+
+# Everything so far only handles fractions in the range (0, 1), but that's no
+# real restriction.  Any positive rational q can be written as its integer part
+# floor(q) plus a fraction in the range [0, 1), and the fraction (if it isn't
+# zero) has an Egyptian fraction representation of its own.
+
+# Function: egyptianExpansion(rational)
+# Usage: whole, denominators = egyptianExpansion(Fraction(137, 42))
+# -----------------------------------------------------------------------------
+# Given any positive rational number, returns a pair of its integer part and a
+# generator that lazily yields the denominators, in increasing order, of the
+# greedy Egyptian fraction for the rest of it.  If the number is an integer,
+# the generator yields nothing.  Since the terms are produced one at a time,
+# callers may stop early without paying for the rest of the expansion.
+def egyptianExpansion(rational):
+    if rational <= 0:
+        raise Exception("Rational number out of range", rational)
+
+    whole, numerator = divmod(rational.numerator, rational.denominator)
+    if numerator == 0:
+        return whole, iter(())
+    return whole, greedyDenominators(numerator, rational.denominator)
+
+# The denominators of an Egyptian fraction can be enormous, so when storing or
+# sending them it's worth using a compact binary encoding.  Since they are
+# distinct, we write them in increasing order and store the difference between
+# each denominator and the one before it.  Each difference is written as its
+# length in bytes, as a variable-length integer (seven bits per byte, least
+# significant first, with the high bit set on every byte but the last),
+# followed by that many bytes holding the difference itself, most significant
+# first.  This costs just one byte of overhead per term for any denominator
+# with fewer than a thousand bits, and the conversions to and from bytes take
+# linear time even for huge numbers.
+
+# Function: packDenominators(denominators)
+# Usage: data = packDenominators([4, 18, 987, 1622628])
+# -----------------------------------------------------------------------------
+# Encodes an iterable of strictly increasing positive denominators (such as the
+# generator from egyptianExpansion) as a compact string of bytes.
+def packDenominators(denominators):
+    result = bytearray()
+    previous = 0
+    for denominator in denominators:
+        if denominator <= previous:
+            raise Exception("Denominators must be increasing", denominator)
+
+        digits = "%x" % (denominator - previous)
+        if len(digits) % 2 != 0:
+            digits = "0" + digits
+        chunk = binascii.unhexlify(digits)
+        previous = denominator
+
+        # Write the length as a variable-length integer, then the difference.
+        length = len(chunk)
+        while length >= 0x80:
+            result.append(length & 0x7F | 0x80)
+            length = length >> 7
+        result.append(length)
+        result.extend(chunk)
+
+    return bytes(result)
+
+# Function: unpackDenominators(data)
+# Usage: for k in unpackDenominators(data): ...
+# -----------------------------------------------------------------------------
+# Returns a generator that lazily decodes the denominators packed into 'data'
+# by packDenominators.
+def unpackDenominators(data):
+    data = bytearray(data)
+    position = 0
+    previous = 0
+    while position < len(data):
+        # Read the length of the next difference.
+        length = 0
+        shift = 0
+        while True:
+            if position == len(data):
+                raise Exception("Truncated denominator data")
+            byte = data[position]
+            position = position + 1
+            length = length | (byte & 0x7F) << shift
+            shift = shift + 7
+            if byte < 0x80:
+                break
+
+        if length == 0 or position + length > len(data):
+            raise Exception("Truncated denominator data")
+        previous = previous + int(binascii.hexlify(
+            data[position : position + length]), 16)
+        position = position + length
+        yield previous
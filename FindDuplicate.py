@@ -156,9 +156,28 @@
 # most O(c + max{l, 2c}).  All of these values are at most n, so this algorithm
 # runs in time O(n).
 
-def findArrayDuplicate(array):
+import mmap
+import random
+import struct
+import time
+
+# NumPy is only needed to check many arrays at once (see
+# findArrayDuplicateMany below); everything else works without it.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def findArrayDuplicate(array, algorithm = "floyd"):
     assert len(array) > 0
 
+    # Brent's algorithm (see below) finds the same cycle entry with fewer
+    # reads of the array.
+    if algorithm == "brent":
+        return brentCycle(array.__getitem__, len(array) - 1)[0]
+    if algorithm != "floyd":
+        raise Exception("Unknown algorithm", algorithm)
+
     # The "tortoise and hare" step.  We start at the end of the array and try
     # to find an intersection point in the cycle.
     slow = len(array) - 1
@@ -183,3 +202,466 @@ def findArrayDuplicate(array):
         # If the two hit, the intersection index is the duplicate element.
         if slow == finder:
             return slow
+
+# When there are many arrays to check, running the algorithm above on each of
+# them in turn spends nearly all of its time interpreting the same few lines of
+# Python over and over.  Instead, if the arrays all have the same length, we
+# can stack them into the rows of a matrix and run every row's slow, fast, and
+# finder pointers in lockstep, so that each step of the algorithm becomes a
+# handful of NumPy operations over whole columns of pointers.  Different rows
+# finish at different times, so at each step we set aside the rows whose
+# pointers have just met and carry on with the rest.
+
+# Function: findArrayDuplicateMany(arrays)
+# Usage: duplicates = findArrayDuplicateMany(numpy.array([[0, 1, 0],
+#                                                       [1, 0, 1]]))
+# -----------------------------------------------------------------------------
+# Finds a duplicated element in each of many arrays.  'arrays' may be a 2-D
+# NumPy array, in which case each row is treated as a separate array and the
+# result is a NumPy array holding the duplicate found in each row, or a list of
+# array.array buffers (or other sequences), in which case the result is a list.
+# The arrays in a list may have different lengths.  Without NumPy, the arrays
+# are simply checked one at a time.
+def findArrayDuplicateMany(arrays):
+    if numpy is not None and isinstance(arrays, numpy.ndarray):
+        assert arrays.ndim == 2
+        return findRowDuplicates(arrays)
+
+    if numpy is None:
+        return [findArrayDuplicate(array) for array in arrays]
+
+    # Group the arrays by length, then stack each group into a matrix and
+    # check all of its rows at once.
+    groups = {}
+    for index, array in enumerate(arrays):
+        groups.setdefault(len(array), []).append(index)
+
+    result = [None] * len(arrays)
+    for indices in groups.values():
+        matrix = numpy.vstack([asNumPyArray(arrays[index])
+                               for index in indices])
+        for index, duplicate in zip(indices, findRowDuplicates(matrix)):
+            result[index] = int(duplicate)
+    return result
+
+# Function: asNumPyArray(array)
+# Usage: row = asNumPyArray(array('l', [0, 1, 0]))
+# -----------------------------------------------------------------------------
+# Returns a NumPy view of an array.array buffer, sharing its memory, or a NumPy
+# copy of any other sequence.
+def asNumPyArray(array):
+    if hasattr(array, "typecode"):
+        return numpy.frombuffer(array, dtype = numpy.dtype(array.typecode))
+    return numpy.asarray(array)
+
+# Function: findRowDuplicates(matrix)
+# Usage: duplicates = findRowDuplicates(numpy.array([[0, 1, 0], [1, 0, 1]]))
+# -----------------------------------------------------------------------------
+# Runs findArrayDuplicate's algorithm on every row of a 2-D NumPy array at
+# once, returning a NumPy array of the duplicates found.
+def findRowDuplicates(matrix):
+    rows, length = matrix.shape
+    assert length > 0
+
+    result = numpy.empty(rows, dtype = numpy.int64)
+    matrix = matrix.astype(numpy.int64, copy = False)
+
+    # The "tortoise and hare" step, on every row still in play.  'active'
+    # holds the indices of those rows, and 'slow' and 'fast' their pointers.
+    active = numpy.arange(rows)
+    slow = numpy.full(rows, length - 1, dtype = numpy.int64)
+    fast = slow.copy()
+    meeting = numpy.empty(rows, dtype = numpy.int64)
+    while active.size > 0:
+        slow = matrix[active, slow]
+        fast = matrix[active, matrix[active, fast]]
+
+        # Record where the rows whose pointers just met did so, and drop them.
+        met = slow == fast
+        meeting[active[met]] = slow[met]
+        active, slow, fast = active[~met], slow[~met], fast[~met]
+
+    # Now march a finder pointer forward from the end of each row until it
+    # hits that row's slow pointer.
+    active = numpy.arange(rows)
+    slow = meeting
+    finder = numpy.full(rows, length - 1, dtype = numpy.int64)
+    while active.size > 0:
+        slow = matrix[active, slow]
+        finder = matrix[active, finder]
+
+        met = slow == finder
+        result[active[met]] = slow[met]
+        active, slow, finder = active[~met], slow[~met], finder[~met]
+
+    return result
+
+# The algorithm above finds just one duplicate, and only works when the
+# pigeonhole principle guarantees that there is one.  Finding every duplicated
+# value, along with how many times it appears, takes a different approach.  We
+# now only assume that each of the n values is in the range 0 to n - 1, which
+# we check up front rather than wandering off the end of the array.  There are
+# then two ways to do the counting.
+#
+# If we're allowed to modify the array temporarily, we can count in place with
+# O(1) extra memory by using each slot of the array to hold a count as well as
+# its own value.  For each element A[i], we add n to A[A[i] mod n], the slot
+# whose index is the value A[i] originally held.  Once every element has been
+# visited, A[v] div n is the number of times that v appears in the array, and
+# A[v] mod n is still the value originally in slot v.  A final pass reduces
+# every slot mod n, which puts the array back the way it was.  The slots may
+# need to hold values as large as n^2 + n - 1, so for a fixed-width buffer we
+# make sure there's room for those first.
+#
+# If the array is read-only, we instead keep a bitmap of n bits recording which
+# values we've seen, along with counts for just the values seen more than once.
+
+# Function: findAllDuplicates(array, mode = "bitmap")
+# Usage: counts = findAllDuplicates([0, 2, 2, 0, 2])  # {0: 2, 2: 3}
+# -----------------------------------------------------------------------------
+# Given an array of n integers, each in the range 0 to n - 1, returns a
+# dictionary mapping every value that appears more than once to the number of
+# times that it appears.  If 'mode' is "inplace," the array must be mutable;
+# it is used to hold the counts while they're being computed and is restored
+# before the function returns.  If 'mode' is "bitmap," the array is never
+# modified, at the cost of n bits of extra memory.
+def findAllDuplicates(array, mode = "bitmap"):
+    if mode not in ("inplace", "bitmap"):
+        raise Exception("Unknown mode", mode)
+
+    length = len(array)
+    for value in array:
+        if not 0 <= value < length:
+            raise Exception("Value out of range", value)
+
+    if mode == "bitmap":
+        seen = bytearray((length + 7) // 8)
+        counts = {}
+        for value in array:
+            value = int(value)
+            if seen[value >> 3] & (1 << (value & 7)):
+                counts[value] = counts.get(value, 1) + 1
+            else:
+                seen[value >> 3] |= 1 << (value & 7)
+        return counts
+
+    # Make sure the array can hold the counts.
+    largest = largestStorable(array)
+    if largest is not None and length * length + length - 1 > largest:
+        raise Exception("Buffer too narrow to count in place", length)
+
+    try:
+        for i in range(length):
+            home = array[i] % length
+            array[home] = array[home] + length
+
+        counts = {}
+        for value in range(length):
+            count = array[value] // length
+            if count > 1:
+                counts[value] = int(count)
+        return counts
+    finally:
+        # Put the array back the way it was, even if we were interrupted.
+        for i in range(length):
+            array[i] = array[i] % length
+
+# Function: largestStorable(array)
+# Usage: limit = largestStorable(array('i', [0, 1, 0]))
+# -----------------------------------------------------------------------------
+# Returns the largest value that can be stored in an element of a fixed-width
+# array.array or NumPy array, or None if there's no limit (as for a list).
+def largestStorable(array):
+    if hasattr(array, "typecode"):
+        bits = 8 * array.itemsize
+        return (1 << bits) - 1 if array.typecode.isupper() else \
+            (1 << (bits - 1)) - 1
+    if numpy is not None and isinstance(array, numpy.ndarray):
+        return int(numpy.iinfo(array.dtype).max)
+    return None
+
+# findArrayDuplicate only ever asks for the length of its array and for the
+# elements at particular indices, so it works just as well on anything else
+# that supports those operations.  A MappedArray presents a file (or any
+# memory-mapped buffer) of fixed-width integers as such a sequence, reading
+# each element straight out of the mapping, which lets us find duplicates in
+# arrays far too large to load into memory.
+#
+# Following the pointers jumps all over the file, so almost every step may
+# touch a different page.  The operating system normally reads ahead of each
+# page we touch in the hope that we'll want the next ones too, which for this
+# access pattern is mostly wasted I/O.  A MappedArray therefore tells the
+# operating system (where Python supports it) to expect random access.  It
+# also counts how many elements it has read and which pages they came from,
+# which is the real measure of the cost of a search over a file that doesn't
+# fit in the page cache.
+class MappedArray:
+    # The madvise constants for each kind of access a MappedArray may be told
+    # to expect.
+    ADVICE = {
+        "normal": "MADV_NORMAL",
+        "random": "MADV_RANDOM",
+        "sequential": "MADV_SEQUENTIAL",
+        "willneed": "MADV_WILLNEED",
+    }
+
+    def __init__(self, source, typecode = "i", offset = 0, length = None,
+                 advice = "random"):
+        """Creates a view of 'length' integers (by default, as many as will
+        fit) of the given struct typecode, in native byte order, starting
+        'offset' bytes into 'source.'  The source may be the path to a file,
+        which is mapped read-only until the view is closed, or an mmap,
+        NumPy memmap, or other buffer.  'advice' is one of the keys of ADVICE,
+        or None to leave the mapping alone."""
+        self.file = None
+        self.mapping = source
+        if isinstance(source, str):
+            self.file = open(source, "rb")
+            self.mapping = mmap.mmap(self.file.fileno(), 0,
+                                     access = mmap.ACCESS_READ)
+
+        # Index through a typed memoryview where we can.  Python 2 can't take
+        # a memoryview of an mmap, so there we unpack each element by hand.
+        try:
+            data = memoryview(self.mapping).cast("B")
+        except (AttributeError, TypeError):
+            data = None
+
+        self.typecode = typecode
+        self.itemsize = struct.calcsize(typecode)
+        self.offset = offset
+        if length is None:
+            size = len(data) if data is not None else len(self.mapping)
+            length = (size - offset) // self.itemsize
+        self.length = length
+        self.pageSize = mmap.PAGESIZE
+
+        self.view = None
+        if data is not None:
+            self.view = data[offset : offset + length * self.itemsize].cast(
+                typecode)
+
+        self.reads = 0
+        self.pages = set()
+        if advice is not None:
+            self.advise(advice)
+
+    def __len__(self):
+        """Returns the number of integers in the array."""
+        return self.length
+
+    def __getitem__(self, index):
+        """Returns the integer at the given index, which must be in the range
+        [0, len(self)), recording the read."""
+        if not 0 <= index < self.length:
+            raise IndexError("MappedArray index out of range", index)
+
+        position = self.offset + index * self.itemsize
+        self.reads = self.reads + 1
+        self.pages.add(position // self.pageSize)
+
+        if self.view is not None:
+            return self.view[index]
+        return struct.unpack_from(self.typecode, self.mapping, position)[0]
+
+    def pagesTouched(self):
+        """Returns the number of distinct pages that reads have come from."""
+        return len(self.pages)
+
+    def resetCounters(self):
+        """Resets the read and page counts to zero."""
+        self.reads = 0
+        self.pages = set()
+
+    def advise(self, advice):
+        """Tells the operating system what kind of access to expect.  This is
+        only a hint, so it does nothing if the source isn't an mmap or Python
+        doesn't support madvise."""
+        if advice not in MappedArray.ADVICE:
+            raise Exception("Unknown advice", advice)
+
+        flag = getattr(mmap, MappedArray.ADVICE[advice], None)
+        if flag is not None and hasattr(self.mapping, "madvise"):
+            self.mapping.madvise(flag)
+
+    def close(self):
+        """Releases the view and, if the view mapped a file itself, unmaps and
+        closes it."""
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.file is not None:
+            self.mapping.close()
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+# Function: findFileDuplicate(path, typecode = "i", offset = 0,
+#                             advice = "random", algorithm = "floyd")
+# Usage: duplicate, reads, pages = findFileDuplicate("index.bin")
+# -----------------------------------------------------------------------------
+# Runs findArrayDuplicate (with the given algorithm) on the file at the given
+# path, read as an array of integers of the given struct typecode starting
+# 'offset' bytes in, without loading it into memory.  Returns the duplicate
+# along with the number of elements read and the number of distinct pages
+# touched.
+def findFileDuplicate(path, typecode = "i", offset = 0, advice = "random",
+                      algorithm = "floyd"):
+    with MappedArray(path, typecode, offset, advice = advice) as array:
+        duplicate = findArrayDuplicate(array, algorithm)
+        return duplicate, array.reads, array.pagesTouched()
+
+# Floyd's algorithm is only one way to detect a cycle.  Each step of the
+# tortoise-and-hare phase evaluates the function three times (once for the
+# tortoise and twice for the hare), which adds up when each evaluation is
+# expensive - say, a page fault on an array that doesn't fit in memory.
+# Brent's algorithm uses a single pointer that teleports instead.  It keeps a
+# marker at x_(2^k - 1) for k = 0, 1, 2, ... and walks the pointer forward
+# from it up to 2^k steps, looking for the marker again.  Once 2^k is at least
+# both the length l of the cycle and the index c of its start, the pointer
+# comes back around to the marker after exactly l steps, which tells us l
+# directly.  Then we start two pointers at x_0 and x_l and march them forward
+# together; they meet after c steps, at the start of the cycle.  Brent's
+# algorithm evaluates the function only once per step, and on average needs
+# about a third fewer evaluations than Floyd's does to find both c and l.
+#
+# Both algorithms work for any function on any finite set, not just for arrays,
+# so findCycle below runs them on an arbitrary successor function and counts
+# how many times it gets called.
+
+# Function: floydCycle(successor, start)
+# Usage: entry, tail, period = floydCycle(lambda x: x * x % 1001, 2)
+# -----------------------------------------------------------------------------
+# Uses Floyd's algorithm to find the cycle that the sequence start,
+# successor(start), successor(successor(start)), ... eventually falls into.
+# Returns the first element of the sequence that's on the cycle, how many
+# steps it takes to get there, and the length of the cycle.
+def floydCycle(successor, start):
+    # Find a point on the cycle, as in findArrayDuplicate.
+    slow = successor(start)
+    fast = successor(slow)
+    while slow != fast:
+        slow = successor(slow)
+        fast = successor(successor(fast))
+
+    # March a finder up from the start to the beginning of the cycle.
+    tail = 0
+    finder = start
+    while slow != finder:
+        slow = successor(slow)
+        finder = successor(finder)
+        tail = tail + 1
+
+    # Walk once around the cycle to find its length.
+    period = 1
+    runner = successor(finder)
+    while runner != finder:
+        runner = successor(runner)
+        period = period + 1
+
+    return finder, tail, period
+
+# Function: brentCycle(successor, start)
+# Usage: entry, tail, period = brentCycle(lambda x: x * x % 1001, 2)
+# -----------------------------------------------------------------------------
+# Just like floydCycle, but uses Brent's algorithm.
+def brentCycle(successor, start):
+    # Walk the pointer forward from the marker, moving the marker up to the
+    # pointer each time the walk reaches a power of two, until the pointer
+    # finds the marker again.
+    power = 1
+    period = 1
+    marker = start
+    pointer = successor(start)
+    while marker != pointer:
+        if period == power:
+            marker = pointer
+            power = power * 2
+            period = 0
+        pointer = successor(pointer)
+        period = period + 1
+
+    # Start one pointer at x_0 and another 'period' steps ahead of it.  They
+    # meet at the start of the cycle.
+    ahead = start
+    for i in range(period):
+        ahead = successor(ahead)
+
+    tail = 0
+    behind = start
+    while behind != ahead:
+        behind = successor(behind)
+        ahead = successor(ahead)
+        tail = tail + 1
+
+    return behind, tail, period
+
+# The cycle-finding algorithms accepted by findCycle.
+CYCLE_ALGORITHMS = {
+    "floyd": floydCycle,
+    "brent": brentCycle,
+}
+
+# Function: findCycle(successor, start, algorithm = "floyd")
+# Usage: entry, tail, period, evaluations = findCycle(f, 0, "brent")
+# -----------------------------------------------------------------------------
+# Finds the cycle that the sequence start, successor(start), ... falls into,
+# using the given algorithm (one of the keys of CYCLE_ALGORITHMS).  Returns the
+# first element of the sequence on the cycle, how many steps it takes to get
+# there, the length of the cycle, and the number of times that the successor
+# function was called.
+def findCycle(successor, start, algorithm = "floyd"):
+    if algorithm not in CYCLE_ALGORITHMS:
+        raise Exception("Unknown algorithm", algorithm)
+
+    counter = CountingFunction(successor)
+    entry, tail, period = CYCLE_ALGORITHMS[algorithm](counter, start)
+    return entry, tail, period, counter.evaluations
+
+# A wrapper around a function that counts how many times it has been called.
+class CountingFunction:
+    def __init__(self, function):
+        """Wraps the given function of one argument."""
+        self.function = function
+        self.evaluations = 0
+
+    def __call__(self, value):
+        """Calls the wrapped function, counting the call."""
+        self.evaluations = self.evaluations + 1
+        return self.function(value)
+
+# Function: benchmarkCycleFinding(size = 1 << 16, trials = 100)
+# Usage: results = benchmarkCycleFinding()
+# -----------------------------------------------------------------------------
+# Compares the cycle-finding algorithms on 'trials' random functions from
+# {0, 1, ..., size - 1} to itself, each starting from a random element.  Prints
+# and returns a dictionary mapping each algorithm's name to its average number
+# of evaluations and its total time in seconds.
+def benchmarkCycleFinding(size = 1 << 16, trials = 100):
+    generator = random.Random(137)
+    graphs = [([generator.randrange(size) for i in range(size)],
+               generator.randrange(size)) for trial in range(trials)]
+
+    results = {}
+    answers = {}
+    for name in sorted(CYCLE_ALGORITHMS):
+        evaluations = 0
+        answers[name] = []
+        start = time.time()
+        for graph, origin in graphs:
+            answer = findCycle(graph.__getitem__, origin, name)
+            evaluations = evaluations + answer[3]
+            answers[name].append(answer[:3])
+        elapsed = time.time() - start
+
+        results[name] = (float(evaluations) / trials, elapsed)
+        print("%-8s%14.1f evaluations%10.3fs" % (name, results[name][0],
+                                                elapsed))
+
+    assert answers["floyd"] == answers["brent"]
+    return results
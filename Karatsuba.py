@@ -97,43 +97,123 @@
 # the numbers.  I have also included here an implementation of addition and
 # subtraction for arbitrary-precision integers encoded in this format.
 
-def add(lhs, rhs, base):
-    """Adds two arbitrary-precision values in some base together.
-    
-    Given two arrays lhs and rhs of digits in some base 'base,' returns an
-    array of the number lhs + rhs encoded in base 'base.'"""
+from array import array
+import math
+import multiprocessing
+import numbers
+import random
+import time
 
-    # Pad the two inputs to be the same length.
-    length = max(len(lhs), len(rhs))
-    lhs = [0 for i in range(len(lhs), length)] + lhs;
-    rhs = [0 for i in range(len(rhs), length)] + rhs;
+# All of the arithmetic in this file is built on a pair of low-level kernels,
+# addInto and subtractInto, that work on ranges of digits within larger arrays
+# rather than on whole arrays.  Each one reads its operands as the digits
+# lhs[lhsStart:lhsEnd] and rhs[rhsStart:rhsEnd] (most significant digit first,
+# just like everywhere else) and writes the result into a caller-supplied
+# output array, right-aligned so that its last digit lands at out[outEnd - 1].
+# If one operand is shorter than the other, its missing leading digits are
+# treated as zeros, so there's never any need to build padded copies of the
+# inputs.  The output may be the same array as one of the inputs, as long as
+# the two ranges end at the same position, which lets the kernels update a
+# value in place.
+#
+# Both kernels walk the digits once from least-significant to most-significant,
+# carrying (or borrowing) a single digit as they go, and so run in time linear
+# in the length of the longer operand.
+
+def addInto(out, outEnd, lhs, lhsStart, lhsEnd, rhs, rhsStart, rhsEnd, base):
+    """Adds two ranges of digits into an output array.
+
+    Writes the digits of lhs[lhsStart:lhsEnd] + rhs[rhsStart:rhsEnd] into the
+    max(lhsEnd - lhsStart, rhsEnd - rhsStart) positions of 'out' ending at
+    outEnd, and returns the carry (zero or one) out of the top digit."""
+
+    # Make lhs the longer of the two operands.
+    if lhsEnd - lhsStart < rhsEnd - rhsStart:
+        lhs, lhsStart, lhsEnd, rhs, rhsStart, rhsEnd = \
+            rhs, rhsStart, rhsEnd, lhs, lhsStart, lhsEnd
 
-    # Track the carry from the previous column; initially this is zero.
     carry = 0
+    shift = lhsEnd - rhsEnd
+    offset = outEnd - lhsEnd
+
+    # Add the columns where both operands have digits.
+    for i in range(lhsEnd - 1, lhsEnd - (rhsEnd - rhsStart) - 1, -1):
+        column = lhs[i] + rhs[i - shift] + carry
+        if column >= base:
+            out[i + offset] = column - base
+            carry = 1
+        else:
+            out[i + offset] = column
+            carry = 0
+
+    # Then ripple the carry through the rest of the longer operand.
+    for i in range(lhsEnd - (rhsEnd - rhsStart) - 1, lhsStart - 1, -1):
+        column = lhs[i] + carry
+        if column >= base:
+            out[i + offset] = column - base
+            carry = 1
+        else:
+            out[i + offset] = column
+            carry = 0
+
+    return carry
+
+def subtractInto(out, outEnd, lhs, lhsStart, lhsEnd, rhs, rhsStart, rhsEnd,
+                 base):
+    """Subtracts one range of digits from another into an output array.
+
+    Writes the digits of lhs[lhsStart:lhsEnd] - rhs[rhsStart:rhsEnd] into the
+    lhsEnd - lhsStart positions of 'out' ending at outEnd, and returns the
+    borrow (zero or one) out of the top digit, which is zero exactly when
+    lhs >= rhs.  rhs may be shorter than lhs, but any digits of rhs beyond the
+    length of lhs must be zero."""
 
-    # Track the result.  We'll build the array up in reverse to avoid costly
-    # prepend operations that aren't relevant.
-    result = [];
+    # Skip over the leading zeros of rhs that don't fit under lhs.
+    rhsStart = max(rhsStart, rhsEnd - (lhsEnd - lhsStart))
 
-    # Iterate across the digits in reverse, computing the sum.
-    for i in range(1, len(lhs) + 1):
-        # Sum the carry and the two values in this column
-        column = lhs[-i] + rhs[-i] + carry;
+    borrow = 0
+    shift = lhsEnd - rhsEnd
+    offset = outEnd - lhsEnd
 
-        # Output the column value (after modding by the base)
-        result.append(column % base);
+    # Subtract the columns where both operands have digits.
+    for i in range(lhsEnd - 1, lhsEnd - (rhsEnd - rhsStart) - 1, -1):
+        column = lhs[i] - rhs[i - shift] - borrow
+        if column < 0:
+            out[i + offset] = column + base
+            borrow = 1
+        else:
+            out[i + offset] = column
+            borrow = 0
 
-        # Update the carry
-        carry = column / base;
+    # Then ripple the borrow through the rest of lhs.
+    for i in range(lhsEnd - (rhsEnd - rhsStart) - 1, lhsStart - 1, -1):
+        column = lhs[i] - borrow
+        if column < 0:
+            out[i + offset] = column + base
+            borrow = 1
+        else:
+            out[i + offset] = column
+            borrow = 0
 
-    # Prepend the carry to the result if it's nonzero.
-    if carry != 0: result.append(carry)
+    return borrow
 
-    # Reverse the order of the resulting digits; that's the more proper way
-    # to hand them back.
-    result.reverse();
+def add(lhs, rhs, base):
+    """Adds two arbitrary-precision values in some base together.
+    
+    Given two arrays lhs and rhs of digits in some base 'base,' returns an
+    array of the number lhs + rhs encoded in base 'base.'"""
+
+    # Leave room at the front of the result for a carry out of the top digit.
+    length = max(len(lhs), len(rhs))
+    result = [0] * (length + 1)
+    result[0] = addInto(result, length + 1, lhs, 0, len(lhs),
+                        rhs, 0, len(rhs), base)
 
-    return result;
+    # If there was no carry, drop the unused leading digit.
+    if result[0] == 0:
+        del result[0]
+
+    return result
 
 def subtract(lhs, rhs, base):
     """Subtracts two arbitrary-precision values in some base.
@@ -142,64 +222,71 @@ def subtract(lhs, rhs, base):
     array of the number lhs - rhs encoded in base 'base.'  It is assumed that
     lhs >= rhs; an error occurs if this is not the case."""
 
-    # Pad the two inputs to be the same length.
     length = max(len(lhs), len(rhs))
-    lhs = [0 for i in range(len(lhs), length)] + lhs;
-    rhs = [0 for i in range(len(rhs), length)] + rhs;
-
-    # Track the result.  We'll build the array up in reverse to avoid costly
-    # prepend operations that aren't relevant.
-    result = [];
-
-    # Iterate across the digits in reverse, subtracting the values.
-    for i in range(1, len(lhs) + 1):
-        # Compute the difference in this column.
-        difference = lhs[-i] - rhs[-i]
-
-        # If we can subtract without borrowing, do so.
-        if difference >= 0:
-            result.append(difference)
-        # Otherwise, we have to borrow from previous columns.
-        else:
-            j = i + 1
-            while j <= length:
-                # Drop the value of this digit by one.  We do this by adding
-                # base - 1 and then modding by base, which is equivalent to
-                # subtracting one modulo base.
-                lhs[-j] = (lhs[-j] + (base - 1)) % base
-                
-                # If this value didn't wrap around (i.e. its value is not
-                # base - 1), then we're done.  Otherwise, we have to go to the
-                # previous digit.
-                if lhs[-j] != base - 1:
-                    break
-                else:
-                    j = j + 1
-            
-            # Finally, update the result by appending the correct value.
-            # Since we just computed lhs - rhs, we actually want to compute
-            # (base + lhs) - rhs.
-            result.append(difference + base)
-
-    # Reverse the order of the resulting digits; that's the more proper way
-    # to hand them back.
-    result.reverse();
-
-    return result;
-
-def multiply(lhs, rhs, base):
+    result = [0] * length
+    borrow = subtractInto(result, length, lhs, 0, len(lhs),
+                          rhs, 0, len(rhs), base)
+    assert borrow == 0
+
+    return result
+
+def schoolbookInto(out, outStart, lhs, lhsStart, lhsEnd, rhs, rhsStart, rhsEnd,
+                   base):
+    """Multiplies two ranges of digits into an output array.
+
+    Writes the product of lhs[lhsStart:lhsEnd] and rhs[rhsStart:rhsEnd] into
+    the (lhsEnd - lhsStart) + (rhsEnd - rhsStart) positions of 'out' starting
+    at outStart, using the grade-school method."""
+
+    shift = outStart - lhsStart - rhsStart + 1
+    for k in range(outStart, outStart + lhsEnd - lhsStart + rhsEnd - rhsStart):
+        out[k] = 0
+
+    # Multiply the whole of rhs by each digit of lhs in turn, working from the
+    # least-significant digits up and adding each partial product into the
+    # result at the appropriate offset.
+    for i in range(lhsEnd - 1, lhsStart - 1, -1):
+        digit = lhs[i]
+        if digit == 0:
+            continue
+
+        carry = 0
+        for j in range(rhsEnd - 1, rhsStart - 1, -1):
+            column = out[i + j + shift] + digit * rhs[j] + carry
+            out[i + j + shift] = column % base
+            carry = column // base
+        out[i + rhsStart + shift - 1] = carry
+
+def schoolbook(lhs, rhs, base):
+    """Multiplies two arbitrary-precision values using the grade-school method.
+
+    Given two arrays lhs and rhs of digits in some base 'base,' returns an
+    array of len(lhs) + len(rhs) digits (possibly with leading zeros) holding
+    their product, computed in O(len(lhs) len(rhs)) time.  For short inputs
+    this beats Karatsuba's method, whose extra additions and subtractions only
+    pay for themselves once the inputs are long enough."""
+
+    result = [0] * (len(lhs) + len(rhs))
+    schoolbookInto(result, 0, lhs, 0, len(lhs), rhs, 0, len(rhs), base)
+    return result
+
+def multiply(lhs, rhs, base, threshold = 1):
     """Multiplies two arbitrary-precision values in some base.
 
     Given two arrays of lhs and rhs of digits in some base 'base,' returns
     an array of digits corresponding to their product using the Karatsuba
-    algorithm."""
+    algorithm.  Once the inputs are at most 'threshold' digits long, the
+    recursion switches over to schoolbook multiplication."""
 
     assert len(lhs) > 0 and len(rhs) > 0
 
-    # Pad the two inputs to be the same length.
+    # Pad the two inputs to be the same length.  This is the only copy of the
+    # inputs that we'll make.
     length = max(len(lhs), len(rhs))
-    lhs = [0 for i in range(len(lhs), length)] + lhs;
-    rhs = [0 for i in range(len(rhs), length)] + rhs;
+    if len(lhs) < length:
+        lhs = [0] * (length - len(lhs)) + list(lhs)
+    if len(rhs) < length:
+        rhs = [0] * (length - len(rhs)) + list(rhs)
 
     # If the numbers are one digit each, just multiply them and convert the
     # answer back to an (up to) two digit number.
@@ -208,8 +295,49 @@ def multiply(lhs, rhs, base):
         result = lhs[0] * rhs[0]
 
         # Convert it back to an array.
-        return [result] if result < base else [result / base, result % base]
-    
+        return [result] if result < base else [result // base, result % base]
+
+    # Otherwise, set aside room for the product along with a single scratch
+    # workspace big enough for every level of the recursion, then run the
+    # recursion.  If we're multiplying a number by itself, the squaring
+    # recursion gets the same answer with less work.
+    result = [0] * (2 * length)
+    workspace = [0] * workspaceSize(length, threshold)
+    if lhs is rhs:
+        squareInto(result, 0, lhs, 0, length, workspace, 0, base, threshold)
+    else:
+        karatsubaInto(result, 0, lhs, 0, rhs, 0, length, workspace, 0, base,
+                      threshold)
+    return result
+
+def workspaceSize(length, threshold):
+    """Returns the scratch space karatsubaInto needs to multiply two numbers
+    of the given length with the given threshold."""
+
+    if length <= max(threshold, 3):
+        return 0
+
+    m0 = (length + 1) // 2
+    return 4 * (m0 + 1) + workspaceSize(m0 + 1, threshold)
+
+def karatsubaInto(out, outStart, lhs, lhsStart, rhs, rhsStart, length,
+                  work, workStart, base, threshold):
+    """Multiplies two ranges of digits into an output array.
+
+    Writes the 2 * length digits of the product of lhs[lhsStart:lhsStart +
+    length] and rhs[rhsStart:rhsStart + length] into out, starting at
+    outStart, using Karatsuba's algorithm.  Scratch values are kept in
+    work[workStart:], which must have at least workspaceSize(length,
+    threshold) entries available."""
+
+    # If the numbers are short, Karatsuba's method isn't worth the overhead.
+    # We always stop at three digits, since halves of numbers that short
+    # (plus a digit for the carry out of their sum) are no shorter.
+    if length <= max(threshold, 3):
+        schoolbookInto(out, outStart, lhs, lhsStart, lhsStart + length,
+                       rhs, rhsStart, rhsStart + length, base)
+        return
+
     # Otherwise, we need to use Karatsuba's recursive algorithm to compute the
     # values.  To do this, we'll first compute how many digits we'll put into
     # each of the smaller numbers.  This is given by ceil(length / 2), which
@@ -217,30 +345,1206 @@ def multiply(lhs, rhs, base):
     # works because if length is even (length + 1) / 2 = (2n + 1) / 2 = n
     # when using integer division, and if length is odd (length + 1) / 2 =
     # (2n + 1 + 1) / 2 = (2n + 2) / 2 = n + 1.
-    m0 = (length + 1) / 2
-    m1 = length / 2
-
-    # Split the inputs in half.
-    x0 = lhs[  : m0]
-    x1 = lhs[m0 :  ]
-    y0 = rhs[  : m0]
-    y1 = rhs[m0 :  ]
-
-    # Compute p0, p1, and p2.
-    p0 = multiply(x0, y0, base)
-    p1 = multiply(add(x0, x1, base), add(y0, y1, base), base)
-    p2 = multiply(x1, y1, base)
-
-    # Since z0 = p0 and z2 = p2, we don't need to compute them.  However, we
-    # do need to compute z1 = p1 - p0 - p2.
-    z0 = p0
-    z1 = subtract(p1, add(p0, p2, base), base)
-    z2 = p2
-
-    # From these results, compute z0 b^(2m) + z1 b^m + z2.  We separate out
-    # each of these operations.
-    z0prod = z0 + [0 for i in range(0, 2 * m1)]
-    z1prod = z1 + [0 for i in range(0, m1)]
-    z2prod = z2
-
-    return add(add(z0prod, z1prod, base), z2prod, base)
+    m0 = (length + 1) // 2
+    m1 = length // 2
+
+    # Rather than splitting the inputs in half, we just remember where each
+    # half starts: x0 = lhs[lhsStart : x1], x1 = lhs[x1 : lhsStart + length],
+    # and similarly for y0 and y1.
+    x1 = lhsStart + m0
+    y1 = rhsStart + m0
+
+    # Compute p0 and p2 directly into the output.  Since p0 has 2 m0 digits
+    # and p2 has 2 m1 digits, this puts p0 b^(2 m1) + p2 = z0 b^(2 m1) + z2 in
+    # the output with no further work.
+    karatsubaInto(out, outStart, lhs, lhsStart, rhs, rhsStart, m0,
+                  work, workStart, base, threshold)
+    karatsubaInto(out, outStart + 2 * m0, lhs, x1, rhs, y1, m1,
+                  work, workStart, base, threshold)
+
+    # Lay out the workspace: the sums x0 + x1 and y0 + y1 (each m0 + 1 digits,
+    # to leave room for the carry), then their product p1, and then the
+    # scratch space for the recursive calls.
+    xSum = workStart
+    ySum = xSum + m0 + 1
+    p1 = ySum + m0 + 1
+    p1End = p1 + 2 * (m0 + 1)
+
+    work[xSum] = addInto(work, ySum, lhs, lhsStart, x1,
+                         lhs, x1, lhsStart + length, base)
+    work[ySum] = addInto(work, p1, rhs, rhsStart, y1,
+                         rhs, y1, rhsStart + length, base)
+    karatsubaInto(work, p1, work, xSum, work, ySum, m0 + 1,
+                  work, p1End, base, threshold)
+
+    # Compute z1 = p1 - p0 - p2 in place.
+    subtractInto(work, p1End, work, p1, p1End,
+                 out, outStart, outStart + 2 * m0, base)
+    subtractInto(work, p1End, work, p1, p1End,
+                 out, outStart + 2 * m0, outStart + 2 * length, base)
+
+    # Finally, add z1 b^m1 into the output.
+    zEnd = outStart + 2 * length - m1
+    addInto(out, zEnd, out, outStart, zEnd, work, p1, p1End, base)
+
+# Multiplying numbers one digit at a time is hopelessly slow in Python, since
+# every digit costs us several interpreted operations.  We can do much better
+# by packing several digits into each "limb," a single integer holding a block
+# of consecutive digits, and then multiplying the limbs as though they were the
+# digits of a number in a much larger base.  For example, the decimal number
+# 1234567890123 can be regarded as the two-limb number [1234, 567890123] in
+# base 10^9.  This cuts the number of digits, and so the work done, by a large
+# constant factor in the linear steps and by the square of that factor in the
+# schoolbook base case.
+#
+# We choose the largest power of the base that fits in LIMB_BITS bits as the
+# limb base, which keeps each limb (and each product of two limbs) within a
+# machine word.  The limbs are stored in compact arrays of unsigned 64-bit
+# integers, most significant limb first, just like the digit arrays above.
+
+# The number of bits that a single limb may occupy.
+LIMB_BITS = 30
+
+# The array typecode for limbs.  Python 2 lacks 'Q', but 'L' is 64 bits wide
+# on the platforms we care about.
+try:
+    array('Q')
+    LIMB_TYPECODE = 'Q'
+except ValueError:
+    LIMB_TYPECODE = 'L'
+
+# The length (in limbs) at or below which the Karatsuba recursion falls back
+# to schoolbook multiplication.  The best value depends on the host machine;
+# see calibrate().
+KARATSUBA_THRESHOLD = 64
+
+def digitsPerLimb(base):
+    """Returns how many base-'base' digits are packed into a single limb.
+
+    This is the largest k such that base^k fits in LIMB_BITS bits, or one if
+    the base itself is too large for that."""
+
+    k = 1
+    while base ** (k + 1) <= 2 ** LIMB_BITS:
+        k = k + 1
+    return k
+
+def toLimbs(digits, base, k):
+    """Packs an array of digits in base 'base' into limbs of k digits each.
+
+    Returns an array of limbs in base base^k, most significant limb first."""
+
+    limbs = array(LIMB_TYPECODE)
+
+    # The first limb takes whatever digits are left over after splitting the
+    # rest of the number into groups of exactly k digits.
+    start = len(digits) % k or k
+    for end in range(start, len(digits) + 1, k):
+        limb = 0
+        for digit in digits[max(end - k, 0) : end]:
+            limb = limb * base + digit
+        limbs.append(limb)
+
+    return limbs
+
+def fromLimbs(limbs, base, k):
+    """Unpacks an array of limbs in base base^k into an array of digits.
+
+    Returns the digits in base 'base,' most significant first, with any
+    leading zeros removed (zero itself is returned as [0])."""
+
+    digits = []
+    for limb in limbs:
+        # Peel off the k digits of this limb from least-significant up, then
+        # put them back in the right order.
+        block = []
+        for i in range(k):
+            block.append(limb % base)
+            limb = limb // base
+        block.reverse()
+        digits.extend(block)
+
+    # Strip leading zeros.
+    first = 0
+    while first < len(digits) - 1 and digits[first] == 0:
+        first = first + 1
+    return digits[first:]
+
+def fastMultiply(lhs, rhs, base, threshold = None):
+    """Multiplies two arbitrary-precision values in some base using limbs.
+
+    Given two arrays lhs and rhs of digits in some base 'base,' returns an
+    array of digits corresponding to their product, without leading zeros.
+    The digits are packed into machine-word-sized limbs, multiplied with
+    tieredMultiply (using schoolbook multiplication on inputs of at most
+    'threshold' limbs, by default KARATSUBA_THRESHOLD), and then unpacked
+    again."""
+
+    k = digitsPerLimb(base)
+    x = list(toLimbs(lhs, base, k))
+    y = x if lhs is rhs else list(toLimbs(rhs, base, k))
+    product = tieredMultiply(x, y, base ** k, threshold)
+    return fromLimbs(product, base, k)
+
+def calibrate(maxLimbs = 512, repeat = 3):
+    """Picks the Karatsuba threshold that works best on this machine.
+
+    For operand lengths 2, 4, 8, ..., maxLimbs limbs, times schoolbook
+    multiplication against a single level of Karatsuba recursion (with
+    schoolbook multiplication underneath).  The threshold is set to one less
+    than the first length at which Karatsuba's method wins.  Updates and
+    returns KARATSUBA_THRESHOLD."""
+
+    global KARATSUBA_THRESHOLD
+
+    limbBase = 2 ** LIMB_BITS
+    generator = random.Random(137)
+
+    length = 2
+    while length <= maxLimbs:
+        lhs = [generator.randrange(limbBase) for i in range(length)]
+        rhs = [generator.randrange(limbBase) for i in range(length)]
+
+        # Halves of the inputs may be up to (length + 1) / 2 limbs long, and
+        # their sums one limb longer than that.
+        split = (length + 1) // 2 + 1
+        schoolbookTime = bestTime(lambda: schoolbook(lhs, rhs, limbBase),
+                                  repeat)
+        karatsubaTime = bestTime(lambda: multiply(lhs, rhs, limbBase, split),
+                                 repeat)
+        if karatsubaTime < schoolbookTime:
+            break
+        length = length * 2
+
+    KARATSUBA_THRESHOLD = length - 1
+    return KARATSUBA_THRESHOLD
+
+def bestTime(function, repeat):
+    """Returns the shortest time, in seconds, of several calls to function."""
+
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+# Karatsuba's method is a special case of a more general family of algorithms
+# due to Toom and Cook.  Karatsuba splits each number into two pieces, which we
+# can think of as the coefficients of a linear polynomial in x = b^k, and then
+# recovers the (quadratic) product polynomial from its values at three points.
+# Toom-3 instead splits each number into three pieces
+#
+#     x = x2 b^(2k) + x1 b^k + x0
+#
+# and regards the product as a degree-four polynomial, which is determined by
+# its values at any five points.  We choose the points 0, 1, -1, -2, and
+# infinity (where the "value" is just the leading coefficient), so that
+# evaluating the factors at those points takes only additions, subtractions and
+# doublings.  Five recursive multiplies on numbers a third the size gives a
+# runtime of T(n) = 5T(n / 3) + O(n) = O(n^(log_3 5)), which is about
+# O(n^1.46).
+#
+# Recovering the coefficients of the product from its values requires exact
+# division by 2 and 3, and along the way some of the values are negative, so
+# the code below tracks a separate sign for each intermediate value.  The
+# particular sequence of steps for the interpolation is due to Marco Bodrato.
+
+def trim(digits):
+    """Returns the digits with any leading zeros removed (keeping at least
+    one digit)."""
+
+    first = 0
+    while first < len(digits) - 1 and digits[first] == 0:
+        first = first + 1
+    return digits[first:] if first > 0 else digits
+
+def compareDigits(lhs, rhs):
+    """Compares two arrays of digits, returning -1, 0, or 1 as lhs is less
+    than, equal to, or greater than rhs."""
+
+    lhs = trim(lhs)
+    rhs = trim(rhs)
+    if len(lhs) != len(rhs):
+        return -1 if len(lhs) < len(rhs) else 1
+    for i in range(len(lhs)):
+        if lhs[i] != rhs[i]:
+            return -1 if lhs[i] < rhs[i] else 1
+    return 0
+
+def signedAdd(lhs, lhsNegative, rhs, rhsNegative, base):
+    """Adds two signed arbitrary-precision values.
+
+    Each value is given as an array of digits of its magnitude along with a
+    flag that is True if the value is negative.  Returns the sum in the same
+    form, as a pair (digits, negative)."""
+
+    if lhsNegative == rhsNegative:
+        return trim(add(lhs, rhs, base)), lhsNegative
+    if compareDigits(lhs, rhs) >= 0:
+        return trim(subtract(lhs, rhs, base)), lhsNegative
+    return trim(subtract(rhs, lhs, base)), rhsNegative
+
+def scaleDigits(digits, factor, base):
+    """Multiplies an array of digits by a nonnegative integer.  The factor
+    may be larger than the base, in which case the final carry may take more
+    than one digit."""
+
+    result = [0] * len(digits)
+    carry = 0
+    for i in range(len(digits) - 1, -1, -1):
+        column = digits[i] * factor + carry
+        result[i] = column % base
+        carry = column // base
+
+    # Spread whatever is left of the carry over as many new digits as it
+    # needs.
+    high = []
+    while carry > 0:
+        high.append(carry % base)
+        carry = carry // base
+    high.reverse()
+    return trim(high + result)
+
+def divmodDigits(digits, divisor, base):
+    """Divides an array of digits by a small positive integer, returning the
+    quotient (as an array of digits) and the remainder."""
+
+    result = [0] * len(digits)
+    remainder = 0
+    for i in range(len(digits)):
+        column = remainder * base + digits[i]
+        result[i] = column // divisor
+        remainder = column % divisor
+    return trim(result), remainder
+
+def divideDigits(digits, divisor, base):
+    """Divides an array of digits by a small positive integer that is known
+    to divide it exactly."""
+
+    result, remainder = divmodDigits(digits, divisor, base)
+    assert remainder == 0
+    return result
+
+def toom3(lhs, rhs, base):
+    """Multiplies two arbitrary-precision values using Toom-3.
+
+    Given two arrays lhs and rhs of digits in some base 'base,' returns an
+    array of len(lhs) + len(rhs) digits (possibly with leading zeros) holding
+    their product.  The five recursive products are handed to
+    tieredMultiply, so that they use whichever algorithm suits their size."""
+
+    # Numbers this short can't be split into three smaller pieces usefully.
+    length = max(len(lhs), len(rhs))
+    if length <= 3:
+        return schoolbook(lhs, rhs, base)
+
+    # Split each number into three pieces of k digits each (the top piece may
+    # be shorter or even empty).
+    k = (length + 2) // 3
+    def piece(digits, i):
+        end = len(digits) - i * k
+        return trim(digits[max(end - k, 0) : end]) if end > 0 else [0]
+
+    # Evaluate each factor at 0, 1, -1, -2, and infinity.
+    def evaluate(digits):
+        x0, x1, x2 = piece(digits, 0), piece(digits, 1), piece(digits, 2)
+        t = trim(add(x0, x2, base))
+        one = trim(add(t, x1, base))
+        minusOne = signedAdd(t, False, x1, True, base)
+        minusTwo = signedAdd(minusOne[0], minusOne[1], x2, False, base)
+        minusTwo = signedAdd(scaleDigits(minusTwo[0], 2, base), minusTwo[1],
+                             x0, True, base)
+        return [(x0, False), (one, False), minusOne, minusTwo, (x2, False)]
+
+    # Multiply pointwise.  The product at each point is negative if exactly
+    # one of the factors is.  When squaring, we evaluate just once, so that
+    # each pointwise product is itself a square.
+    lhsValues = evaluate(lhs)
+    rhsValues = lhsValues if lhs is rhs else evaluate(rhs)
+    products = []
+    for (x, xNegative), (y, yNegative) in zip(lhsValues, rhsValues):
+        products.append((trim(tieredMultiply(x, y, base)),
+                         xNegative != yNegative))
+    r0, r1, rMinus1, rMinus2, rInf = products
+
+    # Interpolate to recover the coefficients of the product polynomial.
+    def half(value):
+        return divideDigits(value[0], 2, base), value[1]
+
+    r3 = signedAdd(rMinus2[0], rMinus2[1], r1[0], not r1[1], base)
+    r3 = divideDigits(r3[0], 3, base), r3[1]
+    r1 = half(signedAdd(r1[0], r1[1], rMinus1[0], not rMinus1[1], base))
+    r2 = signedAdd(rMinus1[0], rMinus1[1], r0[0], not r0[1], base)
+    r3 = half(signedAdd(r2[0], r2[1], r3[0], not r3[1], base))
+    r3 = signedAdd(r3[0], r3[1], scaleDigits(rInf[0], 2, base), False, base)
+    r2 = signedAdd(r2[0], r2[1], r1[0], r1[1], base)
+    r2 = signedAdd(r2[0], r2[1], rInf[0], True, base)
+    r1 = signedAdd(r1[0], r1[1], r3[0], not r3[1], base)
+
+    # Every coefficient of the product is nonnegative, so all that remains is
+    # to add them together at the appropriate offsets.  (If one input is much
+    # shorter than the other, the top coefficients are zero and may not even
+    # fit in the result, so we skip them.)
+    result = [0] * (len(lhs) + len(rhs))
+    end = len(result)
+    for i, (coefficient, negative) in enumerate([r0, r1, r2, r3, rInf]):
+        if coefficient == [0]:
+            continue
+        assert not negative
+        addInto(result, end - i * k, result, 0, end - i * k,
+                coefficient, 0, len(coefficient), base)
+    return result
+
+# Beyond a certain size, the fastest practical approach is to stop thinking of
+# multiplication as a recursion on numbers at all.  The digits of the product
+# (before carrying) are the convolution of the digits of the two factors, and
+# convolutions can be computed in O(n log n) time with the fast Fourier
+# transform.  To avoid floating-point rounding errors, we use the number-
+# theoretic transform, which is the same algorithm carried out in the integers
+# modulo a prime p for which there is a 2^k-th root of unity.  The primes
+# below all have the form c 2^k + 1 with 3 as a primitive root.
+#
+# The convolution can have entries as large as n (b - 1)^2, which may be much
+# larger than any one prime, so we compute it modulo three different primes and
+# then reconstruct the true values with the Chinese remainder theorem.  That
+# lets us handle entries up to about 2^86, which is plenty for 30-bit limbs.
+#
+# A prime of the form c 2^k + 1 (with c odd) only has 2^j-th roots of unity for
+# j <= k, so transforms can be no longer than 2^k.  The first prime below is
+# 119 2^23 + 1, which limits us to transforms of length NTT_MAX_SIZE = 2^23.
+# Products too long for that (or with entries too large for the three primes)
+# are handed to Toom-3, which splits them into pieces that fit.
+NTT_PRIMES = [998244353, 167772161, 469762049]
+NTT_ROOT = 3
+NTT_MAX_SIZE = 2 ** 23
+
+def ntt(values, prime, inverse):
+    """Computes the number-theoretic transform of 'values' modulo 'prime' in
+    place.  The length of 'values' must be a power of two."""
+
+    n = len(values)
+
+    # Permute the values into bit-reversed order.
+    j = 0
+    for i in range(1, n):
+        bit = n >> 1
+        while j & bit:
+            j = j ^ bit
+            bit = bit >> 1
+        j = j | bit
+        if i < j:
+            values[i], values[j] = values[j], values[i]
+
+    # Combine transforms of length 1, 2, 4, ... into longer ones with the
+    # usual Cooley-Tukey butterflies.
+    length = 2
+    while length <= n:
+        root = pow(NTT_ROOT, (prime - 1) // length, prime)
+        if inverse:
+            root = pow(root, prime - 2, prime)
+
+        half = length // 2
+        twiddles = [1] * half
+        for i in range(1, half):
+            twiddles[i] = twiddles[i - 1] * root % prime
+
+        for start in range(0, n, length):
+            for i in range(half):
+                u = values[start + i]
+                v = values[start + i + half] * twiddles[i] % prime
+                values[start + i] = (u + v) % prime
+                values[start + i + half] = (u - v) % prime
+
+        length = length * 2
+
+    # The inverse transform also needs to divide through by n.
+    if inverse:
+        scale = pow(n, prime - 2, prime)
+        for i in range(n):
+            values[i] = values[i] * scale % prime
+
+def nttMultiply(lhs, rhs, base):
+    """Multiplies two arbitrary-precision values using the number-theoretic
+    transform.
+
+    Given two arrays lhs and rhs of digits in some base 'base,' returns an
+    array of len(lhs) + len(rhs) digits (possibly with leading zeros) holding
+    their product.  Inputs too long for the transform, or whose convolution
+    could overflow the three primes, are multiplied with toom3 instead."""
+
+    # The convolution has len(lhs) + len(rhs) - 1 entries; round the transform
+    # length up to a power of two.
+    size = 1
+    while size < len(lhs) + len(rhs) - 1:
+        size = size * 2
+
+    modulus = NTT_PRIMES[0] * NTT_PRIMES[1] * NTT_PRIMES[2]
+    if size > NTT_MAX_SIZE or \
+            min(len(lhs), len(rhs)) * (base - 1) ** 2 >= modulus:
+        return toom3(lhs, rhs, base)
+
+    # When squaring, the two transforms are the same, so we only take one.
+    residues = []
+    for prime in NTT_PRIMES:
+        x = [digit % prime for digit in lhs] + [0] * (size - len(lhs))
+        ntt(x, prime, False)
+        if lhs is rhs:
+            y = x
+        else:
+            y = [digit % prime for digit in rhs] + [0] * (size - len(rhs))
+            ntt(y, prime, False)
+        for i in range(size):
+            x[i] = x[i] * y[i] % prime
+        ntt(x, prime, True)
+        residues.append(x)
+
+    # Reconstruct each entry of the convolution from its three residues with
+    # Garner's algorithm, then carry from the least-significant digit up.
+    p0, p1, p2 = NTT_PRIMES
+    inverse01 = pow(p0, p1 - 2, p1)
+    inverse012 = pow(p0 * p1 % p2, p2 - 2, p2)
+
+    result = [0] * (len(lhs) + len(rhs))
+    carry = 0
+    for i in range(len(lhs) + len(rhs) - 2, -1, -1):
+        a0, a1, a2 = residues[0][i], residues[1][i], residues[2][i]
+        c1 = (a1 - a0) * inverse01 % p1
+        c2 = (a2 - a0 - c1 * p0) * inverse012 % p2
+        column = a0 + c1 * p0 + c2 * p0 * p1 + carry
+        result[i + 1] = column % base
+        carry = column // base
+    result[0] = carry
+    return result
+
+# The length (in digits) above which tieredMultiply switches from Karatsuba's
+# method to Toom-3, and from Toom-3 to the number-theoretic transform.  See
+# benchmarkTiers() for how these were chosen.
+TOOM3_THRESHOLD = 96
+NTT_THRESHOLD = 384
+
+def tieredMultiply(lhs, rhs, base, threshold = None):
+    """Multiplies two arbitrary-precision values in some base, using the best
+    algorithm for their size.
+
+    Given two arrays lhs and rhs of digits in some base 'base,' returns an
+    array of digits (possibly with leading zeros) holding their product.
+    Inputs of at most 'threshold' digits (by default KARATSUBA_THRESHOLD) use
+    schoolbook multiplication, those of at most TOOM3_THRESHOLD digits use
+    Karatsuba's method, those of at most NTT_THRESHOLD digits use Toom-3, and
+    anything larger uses the number-theoretic transform.  If lhs and rhs are
+    the same object, the product is computed with square() instead."""
+
+    if threshold is None:
+        threshold = KARATSUBA_THRESHOLD
+    if lhs is rhs:
+        return square(lhs, base, threshold)
+
+    length = max(len(lhs), len(rhs))
+    if length <= threshold:
+        return schoolbook(lhs, rhs, base)
+    if length <= TOOM3_THRESHOLD:
+        return multiply(lhs, rhs, base, threshold)
+    if length <= NTT_THRESHOLD:
+        return toom3(lhs, rhs, base)
+    return nttMultiply(lhs, rhs, base)
+
+def benchmarkTiers(sizes = (16, 64, 256, 1024, 4096, 16384), repeat = 1):
+    """Times each multiplication algorithm on random operands of the given
+    lengths (in 30-bit limbs), skipping the quadratic and Karatsuba methods
+    where they become hopelessly slow.  Prints a table of the times in seconds
+    and returns it as a list of (length, times) rows, where times maps each
+    algorithm's name to its time."""
+
+    limbBase = 2 ** LIMB_BITS
+    generator = random.Random(137)
+    tiers = [("schoolbook", lambda x, y: schoolbook(x, y, limbBase), 4096),
+             ("karatsuba", lambda x, y: multiply(x, y, limbBase,
+                                                 KARATSUBA_THRESHOLD), 16384),
+             ("toom3", lambda x, y: toom3(x, y, limbBase), None),
+             ("ntt", lambda x, y: nttMultiply(x, y, limbBase), None)]
+
+    print("%8s" % "limbs" + "".join("%12s" % name for name, f, m in tiers))
+    rows = []
+    for length in sizes:
+        x = [generator.randrange(limbBase) for i in range(length)]
+        y = [generator.randrange(limbBase) for i in range(length)]
+
+        times = {}
+        for name, function, maxLength in tiers:
+            if maxLength is None or length <= maxLength:
+                times[name] = bestTime(lambda: function(x, y), repeat)
+
+        print("%8d" % length + "".join("%12s" % ("%.4f" % times[name]
+                                                 if name in times else "-")
+                                       for name, f, m in tiers))
+        rows.append((length, times))
+    return rows
+
+# Squaring a number is a common enough special case that it's worth handling
+# on its own.  In the grade-school method, the product x_i x_j appears twice in
+# the square for every pair i != j, so we can compute each cross product just
+# once, double the total, and then add in the squares x_i^2 of the individual
+# digits.  That does about half the digit multiplications of the general
+# method.  Karatsuba's method carries over directly, since with y = x its three
+# sub-products x0 x0, x1 x1, and (x0 + x1)(x0 + x1) are themselves squares, and
+# Toom-3 and the number-theoretic transform only need to evaluate or transform
+# the one input instead of two.
+
+def schoolbookSquareInto(out, outStart, digits, start, end, base):
+    """Squares a range of digits into an output array.
+
+    Writes the square of digits[start:end] into the 2 (end - start) positions
+    of 'out' starting at outStart, using the grade-school method with each
+    cross product computed only once."""
+
+    length = end - start
+    shift = outStart - 2 * start + 1
+    for k in range(outStart, outStart + 2 * length):
+        out[k] = 0
+
+    # Add up the cross products x_i x_j for j < i.  Row i touches positions
+    # i + 1 through 2i (relative to the start of the range), with its carry
+    # landing at position i, which no earlier row has written to.
+    for i in range(end - 1, start, -1):
+        digit = digits[i]
+        if digit == 0:
+            continue
+
+        carry = 0
+        for j in range(i - 1, start - 1, -1):
+            column = out[i + j + shift] + digit * digits[j] + carry
+            out[i + j + shift] = column % base
+            carry = column // base
+        out[i + start + shift - 1] = carry
+
+    # Double the cross products, then add the square of each digit in at
+    # positions 2i and 2i + 1.
+    carry = 0
+    for k in range(outStart + 2 * length - 1, outStart - 1, -1):
+        column = 2 * out[k] + carry
+        out[k] = column % base
+        carry = column // base
+
+    carry = 0
+    for i in range(end - 1, start - 1, -1):
+        high, low = divmod(digits[i] * digits[i], base)
+        k = 2 * i + shift
+        column = out[k] + low + carry
+        out[k] = column % base
+        column = out[k - 1] + high + column // base
+        out[k - 1] = column % base
+        carry = column // base
+    assert carry == 0
+
+def squareInto(out, outStart, digits, start, length, work, workStart, base,
+               threshold):
+    """Squares a range of digits into an output array.
+
+    Writes the 2 * length digits of the square of digits[start:start + length]
+    into out, starting at outStart, using Karatsuba's algorithm.  This is just
+    like karatsubaInto with both inputs the same, except that it needs only
+    one sum and so only part of the workspace."""
+
+    if length <= max(threshold, 3):
+        schoolbookSquareInto(out, outStart, digits, start, start + length,
+                             base)
+        return
+
+    m0 = (length + 1) // 2
+    m1 = length // 2
+    x1 = start + m0
+
+    # p0 = x0^2 and p2 = x1^2 go straight into the output.
+    squareInto(out, outStart, digits, start, m0, work, workStart, base,
+               threshold)
+    squareInto(out, outStart + 2 * m0, digits, x1, m1, work, workStart, base,
+               threshold)
+
+    # p1 = (x0 + x1)^2 goes into the workspace, after the sum itself.
+    xSum = workStart
+    p1 = xSum + m0 + 1
+    p1End = p1 + 2 * (m0 + 1)
+
+    work[xSum] = addInto(work, p1, digits, start, x1,
+                         digits, x1, start + length, base)
+    squareInto(work, p1, work, xSum, m0 + 1, work, p1End, base, threshold)
+
+    # Compute z1 = p1 - p0 - p2 = 2 x0 x1 and add z1 b^m1 into the output.
+    subtractInto(work, p1End, work, p1, p1End,
+                 out, outStart, outStart + 2 * m0, base)
+    subtractInto(work, p1End, work, p1, p1End,
+                 out, outStart + 2 * m0, outStart + 2 * length, base)
+
+    zEnd = outStart + 2 * length - m1
+    addInto(out, zEnd, out, outStart, zEnd, work, p1, p1End, base)
+
+def square(digits, base, threshold = None):
+    """Squares an arbitrary-precision value in some base.
+
+    Given an array of digits in some base 'base,' returns an array of
+    2 len(digits) digits (possibly with leading zeros) holding its square.
+    Like tieredMultiply, this uses the grade-school method on inputs of at
+    most 'threshold' digits (by default KARATSUBA_THRESHOLD), then Karatsuba's
+    method, Toom-3, and the number-theoretic transform as the input grows, but
+    each of them takes advantage of the two factors being the same."""
+
+    if threshold is None:
+        threshold = KARATSUBA_THRESHOLD
+
+    length = len(digits)
+    if length <= threshold:
+        result = [0] * (2 * length)
+        schoolbookSquareInto(result, 0, digits, 0, length, base)
+        return result
+    if length <= TOOM3_THRESHOLD:
+        result = [0] * (2 * length)
+        workspace = [0] * workspaceSize(length, threshold)
+        squareInto(result, 0, digits, 0, length, workspace, 0, base,
+                   threshold)
+        return result
+    if length <= NTT_THRESHOLD:
+        return toom3(digits, digits, base)
+    return nttMultiply(digits, digits, base)
+
+def multiplyMany(pairs, base, processes = None):
+    """Multiplies many pairs of arbitrary-precision values at once.
+
+    Given a sequence of pairs (lhs, rhs) of arrays of digits in some base
+    'base,' returns a list of their products (computed with fastMultiply) in
+    the same order as the pairs.  The products are independent of one another,
+    so they're farmed out to a pool of 'processes' worker processes (by
+    default, one per CPU).  Starting the pool and shipping the digits back and
+    forth isn't free, so this only pays off for large batches or large
+    operands; with processes = 1 or a single pair, the work is done in this
+    process instead."""
+
+    tasks = [(lhs, rhs, base) for lhs, rhs in pairs]
+    if len(tasks) <= 1 or processes == 1:
+        return [multiplyPair(task) for task in tasks]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        # map hands the results back in the order of the tasks, however the
+        # workers happen to finish.
+        return pool.map(multiplyPair, tasks)
+    finally:
+        pool.terminate()
+        pool.join()
+
+def multiplyPair(task):
+    """The worker half of multiplyMany, which multiplies the pair in a single
+    (lhs, rhs, base) task.  It lives at the top level of the module so that
+    the pool can find it by name."""
+
+    lhs, rhs, base = task
+    return fastMultiply(lhs, rhs, base)
+
+# The three sub-products in each step of Karatsuba's method are independent of
+# one another, so for very large numbers we can compute them on separate cores.
+# parallelMultiply unrolls the top 'levels' levels of the recursion in this
+# process, which leaves 3^levels independent products at the bottom, and hands
+# those to a pool of worker processes.  Shipping the digits to and from the
+# workers one task at a time would mean pickling them every time, so instead
+# the operands of all of the products are laid out end to end in a single
+# block of shared memory, and the workers write their products into a second
+# shared block.  Once every product is done, this process combines them back up
+# the recursion exactly as karatsubaInto does.
+#
+# Starting the pool and splitting the numbers cost time linear in their length,
+# which only pays for itself when the products are large, so below
+# PARALLEL_THRESHOLD digits (and at any level where the pieces are that short)
+# we just multiply in this process.  The digits are stored in the shared blocks
+# as LIMB_TYPECODE values, so they must fit in 64 bits.
+PARALLEL_THRESHOLD = 2048
+
+# The shared operand and product blocks, the base, and the Karatsuba threshold
+# for the current parallelMultiply, as seen from inside a worker process.
+_parallelState = None
+
+def parallelMultiply(lhs, rhs, base, processes = None, levels = 2,
+                     threshold = None):
+    """Multiplies two arbitrary-precision values using a pool of processes.
+
+    Given two arrays lhs and rhs of digits in some base 'base,' returns an
+    array of 2 max(len(lhs), len(rhs)) digits (possibly with leading zeros)
+    holding their product.  The top 'levels' levels of Karatsuba's recursion
+    run in this process, and the products at the bottom are computed with
+    tieredMultiply (passing along 'threshold') in a pool of 'processes' worker
+    processes (by default, one per CPU).  Inputs shorter than
+    PARALLEL_THRESHOLD digits, or a pool of one process, are multiplied
+    serially instead."""
+
+    assert len(lhs) > 0 and len(rhs) > 0
+    assert base <= 2 ** 63
+
+    length = max(len(lhs), len(rhs))
+    lhs = [0] * (length - len(lhs)) + list(lhs)
+    rhs = [0] * (length - len(rhs)) + list(rhs)
+    if length < PARALLEL_THRESHOLD or levels <= 0 or processes == 1:
+        result = tieredMultiply(lhs, rhs, base, threshold)
+        return [0] * (2 * length - len(result)) + result
+
+    # Unroll the top of the recursion.  Each leaf of the resulting plan is the
+    # index of a product to hand to the pool, and each internal node records
+    # how the products beneath it were split.
+    leaves = []
+    def split(x, y, level):
+        length = len(x)
+        if level == 0 or length < PARALLEL_THRESHOLD:
+            leaves.append((x, y))
+            return len(leaves) - 1
+
+        m0 = (length + 1) // 2
+        xSum = [0] * (m0 + 1)
+        ySum = [0] * (m0 + 1)
+        xSum[0] = addInto(xSum, m0 + 1, x, 0, m0, x, m0, length, base)
+        ySum[0] = addInto(ySum, m0 + 1, y, 0, m0, y, m0, length, base)
+        return (m0, length // 2, split(x[:m0], y[:m0], level - 1),
+                split(x[m0:], y[m0:], level - 1),
+                split(xSum, ySum, level - 1))
+
+    plan = split(lhs, rhs, levels)
+
+    # Lay the operands out in shared memory, remembering where each one (and
+    # each product) lives.
+    tasks = []
+    inputSize = 0
+    outputSize = 0
+    for x, y in leaves:
+        tasks.append((inputSize, len(x), outputSize))
+        inputSize = inputSize + 2 * len(x)
+        outputSize = outputSize + 2 * len(x)
+
+    inputs = multiprocessing.RawArray(LIMB_TYPECODE, inputSize)
+    outputs = multiprocessing.RawArray(LIMB_TYPECODE, outputSize)
+    for (x, y), (start, size, outStart) in zip(leaves, tasks):
+        inputs[start : start + size] = x
+        inputs[start + size : start + 2 * size] = y
+
+    pool = multiprocessing.Pool(processes, initParallelWorker,
+                                (inputs, outputs, base, threshold))
+    try:
+        pool.map(multiplyShared, tasks)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    # Put the products back together, combining p0, p1, and p2 at each level
+    # just as karatsubaInto does.
+    def combine(node):
+        if not isinstance(node, tuple):
+            start, size, outStart = tasks[node]
+            return outputs[outStart : outStart + 2 * size]
+
+        m0, m1, low, high, middle = node
+        result = combine(low) + combine(high)
+        p1 = combine(middle)
+        subtractInto(p1, len(p1), p1, 0, len(p1), result, 0, 2 * m0, base)
+        subtractInto(p1, len(p1), p1, 0, len(p1),
+                     result, 2 * m0, len(result), base)
+
+        zEnd = len(result) - m1
+        addInto(result, zEnd, result, 0, zEnd, p1, 0, len(p1), base)
+        return result
+
+    return combine(plan)
+
+def initParallelWorker(inputs, outputs, base, threshold):
+    """Stashes the shared state for parallelMultiply in a new worker process.
+    The shared blocks have to be handed over when the worker starts, rather
+    than with each task."""
+
+    global _parallelState
+    _parallelState = (inputs, outputs, base, threshold)
+
+def multiplyShared(task):
+    """The worker half of parallelMultiply.  Given the (start, size, outStart)
+    position of a pair of operands in the shared input block, multiplies them
+    and writes their product into the shared output block at outStart."""
+
+    inputs, outputs, base, threshold = _parallelState
+    start, size, outStart = task
+    product = tieredMultiply(inputs[start : start + size],
+                             inputs[start + size : start + 2 * size],
+                             base, threshold)
+
+    # The product may come back without its leading zeros; the output block
+    # starts out zeroed, so we just right-align it.
+    outEnd = outStart + 2 * size
+    outputs[outEnd - len(product) : outEnd] = product
+
+def benchmarkParallelMultiply(length = 1 << 15, processCounts = None,
+                              levels = 2, repeat = 1):
+    """Times parallelMultiply on two random numbers of 'length' 30-bit limbs
+    with pools of each of the given sizes (by default 1, 2, 4, ... up to the
+    number of CPUs).  Prints the time and the speedup over the serial
+    multiplication for each, and returns them as a list of (processes, time,
+    speedup) rows."""
+
+    limbBase = 2 ** LIMB_BITS
+    generator = random.Random(137)
+    lhs = [generator.randrange(limbBase) for i in range(length)]
+    rhs = [generator.randrange(limbBase) for i in range(length)]
+
+    if processCounts is None:
+        processCounts = [1]
+        while processCounts[-1] * 2 <= multiprocessing.cpu_count():
+            processCounts.append(processCounts[-1] * 2)
+
+    expected = tieredMultiply(lhs, rhs, limbBase)
+    serialTime = bestTime(lambda: tieredMultiply(lhs, rhs, limbBase), repeat)
+
+    print("%10s%12s%10s" % ("processes", "seconds", "speedup"))
+    rows = []
+    for processes in processCounts:
+        products = []
+        elapsed = bestTime(lambda: products.append(
+            parallelMultiply(lhs, rhs, limbBase, processes, levels)), repeat)
+        assert products[-1] == expected
+        print("%10d%12.3f%10.2f" % (processes, elapsed, serialTime / elapsed))
+        rows.append((processes, elapsed, serialTime / elapsed))
+    return rows
+
+# The functions above all work on raw arrays of digits, which leaves it to the
+# caller to keep track of the base and to convert numbers to and from limbs
+# around every operation.  The BigNum class below wraps all of this up into an
+# arbitrary-precision integer type.  Each BigNum stores its magnitude as an
+# array of limbs in base R = 2^LIMB_BITS (most significant limb first, with no
+# leading zeros) along with a sign.  Arithmetic works directly on the limbs,
+# so a chain of operations never needs to convert anything back to digits.
+#
+# The one place that needs real care is converting between BigNums and digits
+# in some other base b.  Doing this one digit at a time takes quadratic time,
+# since each step multiplies or divides the whole number by b.  Instead, we
+# use divide-and-conquer.  Let B = b^k be the limb base for b, and precompute
+# the powers P_j = B^(2^j) by repeated squaring.  To convert a number with
+# 2^(j+1) limbs in base B to binary, we convert its top and bottom halves
+# separately and combine them as top * P_j + bottom, which costs a single
+# multiplication.  To convert the other way, we divide by P_j and convert the
+# quotient and remainder separately.
+#
+# Division is done with Barrett reduction: once we know the reciprocal
+# I = floor(R^(2n) / P_j), where P_j has n limbs, the quotient of any a < P_j^2
+# by P_j is within a couple of floor(a I / R^(2n)), which takes one multiply
+# (plus a shift, which just drops limbs).  The reciprocals are found with
+# Newton's method, which doubles the number of correct bits on each step, and
+# are cached along with the powers so that each is only computed once.  Either
+# way, conversion takes O(M(n) log n) time, where M(n) is the time to multiply
+# two n-limb numbers.
+
+# The length (in limbs) below which base conversion falls back to the simple
+# quadratic method.
+CONVERSION_THRESHOLD = 32
+
+# For each limb base B, the list of pairs (P_j, I_j) computed so far, where
+# P_j = B^(2^j) and I_j is its Barrett reciprocal, both as arrays of limbs.
+_radixPowers = {}
+
+class BigNum(object):
+    """An arbitrary-precision integer built on the multiplication routines in
+    this module."""
+
+    __slots__ = ("limbs", "negative")
+
+    def __init__(self, value = 0):
+        """Creates a BigNum holding the given Python integer."""
+
+        negative = value < 0
+        value = abs(value)
+
+        limbs = []
+        while True:
+            limbs.append(value & (2 ** LIMB_BITS - 1))
+            value = value >> LIMB_BITS
+            if value == 0:
+                break
+        limbs.reverse()
+
+        self.limbs = array(LIMB_TYPECODE, limbs)
+        self.negative = negative
+
+    @staticmethod
+    def fromLimbs(limbs, negative = False):
+        """Creates a BigNum directly from an array of base-R limbs."""
+
+        result = BigNum.__new__(BigNum)
+        result.limbs = array(LIMB_TYPECODE, trim(limbs))
+
+        # There's no such thing as negative zero.
+        result.negative = negative and result.limbs[0] != 0
+        return result
+
+    @staticmethod
+    def fromDigits(digits, base, negative = False):
+        """Creates a BigNum from an array of digits in the given base."""
+
+        k = digitsPerLimb(base)
+        limbs = toLimbs(digits, base, k) if len(digits) > 0 else [0]
+        return BigNum.fromLimbs(limbsToBinary(list(limbs), base ** k),
+                                negative)
+
+    def toDigits(self, base):
+        """Returns the digits of the magnitude of this BigNum in the given
+        base, most significant first and with no leading zeros."""
+
+        k = digitsPerLimb(base)
+        return fromLimbs(binaryToLimbs(self.limbs, base ** k), base, k)
+
+    def __int__(self):
+        value = 0
+        for limb in self.limbs:
+            value = (value << LIMB_BITS) | limb
+        return -value if self.negative else value
+
+    __long__ = __int__
+
+    def __str__(self):
+        digits = "".join(str(digit) for digit in self.toDigits(10))
+        return "-" + digits if self.negative else digits
+
+    def __repr__(self):
+        return "BigNum(%s)" % str(self)
+
+    def __add__(self, other):
+        if not isOperand(other):
+            return NotImplemented
+        other = toBigNum(other)
+        limbs, negative = signedAdd(self.limbs, self.negative,
+                                    other.limbs, other.negative,
+                                    2 ** LIMB_BITS)
+        return BigNum.fromLimbs(limbs, negative)
+
+    def __sub__(self, other):
+        if not isOperand(other):
+            return NotImplemented
+        other = toBigNum(other)
+        limbs, negative = signedAdd(self.limbs, self.negative,
+                                    other.limbs, not other.negative,
+                                    2 ** LIMB_BITS)
+        return BigNum.fromLimbs(limbs, negative)
+
+    def __mul__(self, other):
+        if not isOperand(other):
+            return NotImplemented
+        other = toBigNum(other)
+        limbs = tieredMultiply(self.limbs, other.limbs, 2 ** LIMB_BITS)
+        return BigNum.fromLimbs(limbs, self.negative != other.negative)
+
+    def __radd__(self, other):
+        if not isOperand(other):
+            return NotImplemented
+        return toBigNum(other) + self
+
+    def __rsub__(self, other):
+        if not isOperand(other):
+            return NotImplemented
+        return toBigNum(other) - self
+
+    def __rmul__(self, other):
+        if not isOperand(other):
+            return NotImplemented
+        return toBigNum(other) * self
+
+    def __neg__(self):
+        return BigNum.fromLimbs(self.limbs, not self.negative)
+
+    def __abs__(self):
+        return BigNum.fromLimbs(self.limbs)
+
+    def __bool__(self):
+        return self.limbs[0] != 0
+
+    __nonzero__ = __bool__
+
+    def compare(self, other):
+        """Returns -1, 0, or 1 as this BigNum is less than, equal to, or
+        greater than other."""
+
+        other = toBigNum(other)
+        if self.negative != other.negative:
+            return -1 if self.negative else 1
+        result = compareDigits(self.limbs, other.limbs)
+        return -result if self.negative else result
+
+    def __eq__(self, other):
+        if not isOperand(other):
+            return NotImplemented
+        return self.compare(other) == 0
+
+    def __ne__(self, other):
+        if not isOperand(other):
+            return NotImplemented
+        return self.compare(other) != 0
+
+    def __lt__(self, other):
+        if not isOperand(other):
+            return NotImplemented
+        return self.compare(other) < 0
+
+    def __le__(self, other):
+        if not isOperand(other):
+            return NotImplemented
+        return self.compare(other) <= 0
+
+    def __gt__(self, other):
+        if not isOperand(other):
+            return NotImplemented
+        return self.compare(other) > 0
+
+    def __ge__(self, other):
+        if not isOperand(other):
+            return NotImplemented
+        return self.compare(other) >= 0
+
+    def __hash__(self):
+        return hash(int(self))
+
+def isOperand(value):
+    """Returns whether the value is a BigNum or a Python integer, and so can
+    take part in BigNum arithmetic and comparisons.  The operators return
+    NotImplemented for anything else, so that (for example) comparing a
+    BigNum with None is simply false rather than an error."""
+
+    return isinstance(value, (BigNum, numbers.Integral))
+
+def toBigNum(value):
+    """Returns the given value as a BigNum, converting it from a Python
+    integer if necessary."""
+
+    if isinstance(value, BigNum):
+        return value
+    if isinstance(value, numbers.Integral):
+        return BigNum(value)
+    raise TypeError("Cannot convert to BigNum", value)
+
+def radixPower(limbBase, j):
+    """Returns the pair (B^(2^j), reciprocal) for the limb base B, computing
+    and caching the powers and reciprocals up to j as needed."""
+
+    powers = _radixPowers.setdefault(limbBase, [])
+    while len(powers) <= j:
+        if len(powers) == 0:
+            power = BigNum(limbBase).limbs
+            powers.append((power, reciprocal(power)))
+            continue
+
+        # Square the previous power.  Squaring the previous reciprocal (and
+        # shifting it to the right scale) also gives an underestimate of the
+        # new reciprocal that's already correct to about half its limbs.
+        previous, previousInverse = powers[-1]
+        power = array(LIMB_TYPECODE,
+                      trim(tieredMultiply(previous, previous,
+                                          2 ** LIMB_BITS)))
+        estimate = trim(tieredMultiply(previousInverse, previousInverse,
+                                       2 ** LIMB_BITS))
+        shift = 2 * len(power) - 4 * len(previous)
+        if shift >= 0:
+            estimate = list(estimate) + [0] * shift
+        else:
+            estimate = estimate[: len(estimate) + shift]
+        powers.append((power, reciprocal(power, estimate)))
+    return powers[j]
+
+def reciprocal(divisor, estimate = None):
+    """Returns floor(R^(2n) / divisor) as an array of limbs, where the
+    divisor is an array of n limbs with a nonzero leading limb.  If given,
+    estimate must be a positive underestimate of the result."""
+
+    n = len(divisor)
+    d = BigNum.fromLimbs(divisor)
+    scale = BigNum.fromLimbs([1] + [0] * (2 * n))
+
+    # Unless we were given a better starting point, start with an
+    # underestimate based on the leading limb of the divisor, which is within
+    # a factor of two of the true value.
+    if estimate is None:
+        estimate = (BigNum((2 ** LIMB_BITS) ** 2 //
+                           (divisor[0] + 1)).limbs.tolist() + [0] * (n - 1))
+    x = BigNum.fromLimbs(estimate)
+
+    # Newton's method for 1/d, in fixed point: x += x (R^(2n) - d x) / R^(2n).
+    # Starting from an underestimate, every iterate stays an underestimate, so
+    # the correction is never negative, and we stop once it vanishes.
+    while True:
+        step = (x * (scale - d * x)).limbs
+        if len(step) <= 2 * n:
+            break
+        x = x + BigNum.fromLimbs(step[: len(step) - 2 * n])
+
+    # The result may still be a little low, so fix it up.
+    remainder = scale - d * x
+    while remainder >= d:
+        x = x + 1
+        remainder = remainder - d
+    return x.limbs
+
+def limbsToBinary(limbs, limbBase):
+    """Converts an array of limbs in base limbBase into an array of base-R
+    limbs."""
+
+    # For short inputs, just use Horner's rule.
+    if len(limbs) <= CONVERSION_THRESHOLD:
+        result = [0]
+        for limb in limbs:
+            result = trim(add(scaleDigits(result, limbBase, 2 ** LIMB_BITS),
+                              BigNum(limb).limbs, 2 ** LIMB_BITS))
+        return result
+
+    # Otherwise, split off the bottom 2^j limbs, where 2^j is the largest
+    # power of two smaller than the length, and recombine the halves as
+    # top * B^(2^j) + bottom.
+    j = 0
+    while 2 ** (j + 1) < len(limbs):
+        j = j + 1
+    top = limbsToBinary(limbs[: len(limbs) - 2 ** j], limbBase)
+    bottom = limbsToBinary(limbs[len(limbs) - 2 ** j :], limbBase)
+    power = radixPower(limbBase, j)[0]
+    return add(tieredMultiply(top, power, 2 ** LIMB_BITS), bottom,
+               2 ** LIMB_BITS)
+
+def binaryToLimbs(limbs, limbBase):
+    """Converts an array of base-R limbs into an array of limbs in base
+    limbBase, most significant first."""
+
+    # Find the smallest j for which B^(2^j) has at least as many bits as the
+    # value, which guarantees that the value is less than B^(2^j).  Working
+    # this out from the bit lengths saves us from computing B^(2^j) itself,
+    # which is the most expensive power of all and only needed for this test.
+    value = BigNum.fromLimbs(limbs)
+    bits = LIMB_BITS * (len(value.limbs) - 1) + value.limbs[0].bit_length()
+    j = 0
+    while 2 ** j * math.log(limbBase, 2) < bits:
+        j = j + 1
+    return splitLimbs(value, j - 1, limbBase)
+
+def splitLimbs(value, j, limbBase):
+    """Converts a BigNum less than B^(2^(j + 1)) into exactly 2^(j + 1) limbs
+    in base B = limbBase."""
+
+    length = 2 ** (j + 1)
+
+    # For short inputs, repeatedly divide by the base.
+    if j < 0 or len(value.limbs) <= CONVERSION_THRESHOLD:
+        result = [0] * length
+        digits = value.limbs
+        for i in range(length - 1, -1, -1):
+            digits, result[i] = divmodDigits(digits, limbBase, 2 ** LIMB_BITS)
+        return result
+
+    # Otherwise, divide by P_j = B^(2^j).  Since value < P_j^2, the Barrett
+    # estimate of the quotient is at most a little too small.
+    power, inverse = radixPower(limbBase, j)
+    divisor = BigNum.fromLimbs(power)
+    product = tieredMultiply(value.limbs, inverse, 2 ** LIMB_BITS)
+    shift = len(product) - 2 * len(power)
+    quotient = BigNum.fromLimbs(product[:shift] if shift > 0 else [0])
+    remainder = value - quotient * divisor
+    while remainder >= divisor:
+        quotient = quotient + 1
+        remainder = remainder - divisor
+
+    return (splitLimbs(quotient, j - 1, limbBase) +
+            splitLimbs(remainder, j - 1, limbBase))
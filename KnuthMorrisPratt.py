@@ -93,6 +93,15 @@
 # This is responsible for the fast runtime of the algorithm (though I'll give a
 # more formal description later on).
 
+from array import array
+from collections import OrderedDict, deque
+import mmap
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
 # Function: failTable(pattern)
 # Usage: failTable("This is a string!")
 # -----------------------------------------------------------------------------
@@ -279,52 +288,718 @@ def failTable(pattern):
     
     return result
 
+# Class: KMPPattern
+# Usage: pattern = KMPPattern("0101"); print pattern.search("0011001011")
+# -----------------------------------------------------------------------------
+# A needle that has been preprocessed for KMP matching.  Building the failure
+# table costs O(|P|) time, which is wasted work if the same needle is searched
+# for over and over again in many short haystacks.  A KMPPattern computes the
+# table once and then reuses it for every search, in the spirit of the regular
+# expression objects returned by re.compile.  The compile function below hands
+# back instances of this class and caches them.
+class KMPPattern:
+    def __init__(self, needle):
+        """Preprocesses the given needle for repeated searching."""
+        self.needle = needle
+        self.fail = failTable(needle)
+
+    # Function: search(haystack)
+    # Usage: print pattern.search("0011001011") # Prints 5
+    # -------------------------------------------------------------------------
+    # Uses the KMP algorithm to find an occurrence of the needle string in the
+    # haystack string.  We iterate across the string, keeping track of a
+    # candidate start point and length matched so far.  Whenever a match
+    # occurs, we update the length of the match we've made.  On a failure, we
+    # update these values by trying to preserve the maximum proper border of
+    # the string we were able to manage by that point.
+    #
+    # The haystack may be any indexable sequence.  In particular, it may be a
+    # bytes-like object or an mmap.mmap (with a bytes needle), which is read in
+    # place one element at a time without being copied.
+    def search(self, haystack):
+        needle = self.needle
+        fail = self.fail
+
+        # Keep track of the start index and next match position, both of which
+        # start at zero since our candidate match is at the beginning and is
+        # trying to match the first character.
+        index = 0
+        match = 0
+
+        # Loop until we fall off the string or match.
+        while index + match < len(haystack):
+            # If the current character matches the expected character, then
+            # bump up the match index.
+            if haystack[index + match] == needle[match]:
+                match = match + 1
+
+                # If we completely matched everything, we're done.
+                if match == len(needle):
+                    return index
+
+            # Otherwise, we need to look at the fail table to determine what to
+            # do next.
+            else:
+                # If we couldn't match the first character, then just advance
+                # the start index.  We need to try again.
+                if match == 0:
+                    index = index + 1
+
+                # Otherwise, see how much we need to skip forward before we
+                # have another feasible match.
+                else:
+                    index = index + match - fail[match]
+                    match = fail[match]
+
+        # If we made it here, then no match was found.
+        return None
+
+    # Function: finditer(chunks, chunkSize = 65536)
+    # Usage: for offset in pattern.finditer(open("server.log")): ...
+    # -------------------------------------------------------------------------
+    # A generator that uses the KMP algorithm to find every occurrence of the
+    # needle in a haystack that is handed to us in pieces, yielding the offset
+    # of each match (measured from the start of the whole haystack) in
+    # increasing order.  The haystack may be any iterable of chunks (strings,
+    # lists, etc.) or a file-like object, in which case it is read chunkSize
+    # elements at a time.  Matches are allowed to overlap, so searching for
+    # "aa" in "aaa" yields both 0 and 1.
+    #
+    # The algorithm here is the same as in search, but phrased slightly
+    # differently.  Rather than tracking a candidate start index into the
+    # haystack (which would require us to hold on to the whole haystack), we
+    # only track the number of characters of the needle matched so far.  This
+    # is the state of the KMP automaton, and since it depends only on the
+    # characters we've read rather than on where they came from, we can carry
+    # it over from one chunk to the next unchanged.  That way, a match that
+    # straddles the boundary between two chunks is found exactly as if the
+    # chunks had been concatenated.
+    #
+    # When we finish matching the whole needle, rather than stopping we fall
+    # back to the longest proper border of the needle, which is the longest
+    # prefix of the needle that could be the start of another (overlapping)
+    # match.  The same amortized argument as before shows that the total work
+    # is O(|P| + |T|).
+    def finditer(self, chunks, chunkSize = 65536):
+        needle = self.needle
+        fail = self.fail
+        length = len(needle)
+
+        # The empty string matches at every position of the haystack,
+        # including the very end, so we just count how long the haystack is.
+        if length == 0:
+            offset = 0
+            for chunk in readChunks(chunks, chunkSize):
+                for i in range(len(chunk)):
+                    yield offset + i
+                offset = offset + len(chunk)
+            yield offset
+            return
+
+        # Track the offset of the start of the current chunk in the haystack,
+        # along with how many characters of the needle we've matched so far.
+        offset = 0
+        match = 0
+
+        for chunk in readChunks(chunks, chunkSize):
+            for i, char in enumerate(chunk):
+                # Fall back through the borders of the matched prefix until the
+                # next character of the needle matches or there is nothing
+                # left.
+                while match > 0 and needle[match] != char:
+                    match = fail[match]
+
+                # If this character extends the current match, bump the length.
+                if needle[match] == char:
+                    match = match + 1
+
+                    # If we matched the whole needle, report where it started
+                    # and fall back to its longest border to look for the next
+                    # match.
+                    if match == length:
+                        yield offset + i + 1 - length
+                        match = fail[match]
+
+            offset = offset + len(chunk)
+
+# Function: dfaTable(pattern, alphabet = None)
+# Usage: table, columns = dfaTable("GATTACA", "ACGT")
+# -----------------------------------------------------------------------------
+# Expands the KMP failure function for the given pattern into a full
+# deterministic finite automaton.  The failure table tells us where to fall
+# back to on a mismatch, but we may need to follow several failure links before
+# we find a state that can consume the next character.  If the alphabet is
+# small, we can instead precompute, for every state and every character, the
+# state we'd eventually end up in.  Matching then costs exactly one table
+# lookup per character of the haystack, with no inner loop at all.
+#
+# The table is built using the same recurrence as the failure table.  State j
+# means that we have matched the first j characters of the pattern.  From state
+# j, reading the character pattern[j] takes us to state j + 1.  Reading any
+# other character takes us to wherever state fail[j] would go on that
+# character, since fail[j] is the longest prefix of the pattern we could still
+# be in the middle of matching.  Since fail[j] < j, that row of the table has
+# already been filled in by the time we need it, and so the whole table can be
+# built in O(|P| |Sigma|) time.  The final state |P| (a complete match) falls
+# back the same way, so overlapping matches are found for free.
+#
+# The table is stored as a flat array of machine integers with one row per
+# state and one column per symbol.  Rather than storing state numbers, each
+# entry holds the offset of the start of the target state's row, so the
+# matching loop can compute the next state as table[state + column] without
+# any multiplication.
+#
+# If the pattern is a bytes-like object and no alphabet is given, the columns
+# are just the 256 possible byte values, and the columns result is None.
+# Otherwise, the alphabet defaults to the distinct symbols of the pattern, and
+# columns is a dictionary mapping each symbol to its column.  Column 0 is
+# reserved for every symbol outside the alphabet, which can never be part of a
+# match.
+def dfaTable(pattern, alphabet = None):
+    # Work out how each symbol maps to a column of the table.
+    if alphabet is None and isinstance(pattern, (bytes, bytearray)):
+        columns = None
+        width = 256
+        symbols = bytearray(pattern)
+    else:
+        if alphabet is None:
+            alphabet = pattern
+        columns = {}
+        for symbol in alphabet:
+            if symbol not in columns:
+                columns[symbol] = len(columns) + 1
+        for symbol in pattern:
+            if symbol not in columns:
+                raise ValueError("Pattern symbol not in alphabet", symbol)
+        width = len(columns) + 1
+        symbols = [columns[symbol] for symbol in pattern]
+
+    fail = failTable(pattern)
+    table = array('i', [0]) * ((len(pattern) + 1) * width)
+
+    for j in range(0, len(pattern) + 1):
+        row = j * width
+
+        # Copy the transitions of the state we'd fall back to.  The start state
+        # has nowhere to fall back to, and stays put on every symbol.
+        if j > 0:
+            back = fail[j] * width
+            table[row : row + width] = table[back : back + width]
+
+        # Reading the next symbol of the pattern advances to the next state.
+        if j < len(pattern):
+            table[row + symbols[j]] = row + width
+
+    return table, columns
+
+# Class: KMPDFAPattern
+# Usage: pattern = KMPDFAPattern(b"GATTACA"); print pattern.search(genome)
+# -----------------------------------------------------------------------------
+# A KMPPattern that matches using the full automaton built by dfaTable rather
+# than by following failure links.  This is worthwhile for small alphabets
+# such as bytes or DNA, where the table stays compact and each character of the
+# haystack costs a single lookup.  For bytes-like needles the haystack must be
+# bytes-like as well; otherwise, each haystack symbol is mapped to its column
+# with one dictionary lookup.
+class KMPDFAPattern(KMPPattern):
+    def __init__(self, needle, alphabet = None):
+        """Preprocesses the given needle into a full matching automaton."""
+        KMPPattern.__init__(self, needle)
+        self.table, self.columns = dfaTable(needle, alphabet)
+
+    def search(self, haystack):
+        """Returns the index of the first match of the needle in the haystack,
+        or None if there is no match."""
+        # Buffers are scanned in place; anything else is a single chunk.
+        if not isinstance(haystack, (bytes, bytearray, memoryview, mmap.mmap)):
+            haystack = [haystack]
+        for offset in self.finditer(haystack):
+            return offset
+        return None
+
+    def finditer(self, chunks, chunkSize = 65536):
+        """Yields the offset of every match of the needle in the chunked
+        haystack, exactly as KMPPattern.finditer does."""
+
+        # The empty needle never moves the automaton, so let the failure table
+        # version handle it.
+        length = len(self.needle)
+        if length == 0:
+            for offset in KMPPattern.finditer(self, chunks, chunkSize):
+                yield offset
+            return
+
+        table = self.table
+        columns = self.columns
+        accept = length * (len(table) // (length + 1))
+
+        offset = 0
+        state = 0
+        for chunk in readChunks(chunks, chunkSize):
+            # Byte patterns index the table directly with each byte value.
+            if columns is None:
+                for i, byte in enumerate(byteValues(chunk)):
+                    state = table[state + byte]
+                    if state == accept:
+                        yield offset + i + 1 - length
+
+            # Otherwise, symbols outside the alphabet go to column 0.
+            else:
+                for i, symbol in enumerate(chunk):
+                    state = table[state + columns.get(symbol, 0)]
+                    if state == accept:
+                        yield offset + i + 1 - length
+
+            offset = offset + len(chunk)
+
+# Function: byteValues(chunk)
+# Usage: for byte in byteValues(b"GATTACA"): ...
+# -----------------------------------------------------------------------------
+# Returns something that iterates over the byte values (as integers) of the
+# given bytes-like chunk, copying it only if iterating over it directly would
+# produce something other than integers.  On Python 3, other buffer objects
+# (such as an mmap.mmap) are wrapped in a byte-wide memoryview rather than
+# copied, so even a whole memory-mapped file costs no extra memory.
+def byteValues(chunk):
+    if isinstance(chunk, bytearray):
+        return chunk
+    if bytes is not str:
+        if isinstance(chunk, (bytes, memoryview)):
+            return chunk
+        try:
+            view = memoryview(chunk)
+        except TypeError:
+            return bytearray(chunk)
+        return view if view.format == "B" else view.cast("B")
+    return bytearray(chunk)
+
+# The maximum number of compiled patterns remembered by compile.  Once the
+# cache is full, the least recently used pattern is evicted to make room.
+MAX_CACHE_SIZE = 512
+
+# The cache itself, mapping needles to their compiled patterns in order from
+# least to most recently used.
+_cache = OrderedDict()
+
+# Function: compile(needle, dfa = False, alphabet = None)
+# Usage: pattern = compile("0101")
+# -----------------------------------------------------------------------------
+# Returns a KMPPattern for the given needle, or a KMPDFAPattern over the given
+# alphabet if dfa is set.  Recently compiled needles are kept in a bounded LRU
+# cache, so repeatedly searching for the same needle (whether through compile,
+# kmpMatch, or kmpFinditer) only builds its tables once.  Needles (or
+# alphabets) that can't be hashed, such as lists, are compiled afresh each
+# time.
+def compile(needle, dfa = False, alphabet = None):
+    # Key the cache on the type as well as the value, so that, for example, a
+    # text needle and a bytes needle never share an entry.
+    key = (type(needle), needle, dfa, alphabet)
+    try:
+        pattern = _cache.pop(key)
+    except TypeError:
+        return _compile(needle, dfa, alphabet)
+    except KeyError:
+        pattern = _compile(needle, dfa, alphabet)
+
+        # Evict the least recently used entry if the cache is full.
+        if len(_cache) >= MAX_CACHE_SIZE:
+            _cache.popitem(last = False)
+
+    # (Re)insert the pattern at the most recently used end of the cache.
+    _cache[key] = pattern
+    return pattern
+
+# Builds a new, uncached pattern of the appropriate kind.
+def _compile(needle, dfa, alphabet):
+    if dfa:
+        return KMPDFAPattern(needle, alphabet)
+    return KMPPattern(needle)
+
+# Function: purge()
+# Usage: purge()
+# -----------------------------------------------------------------------------
+# Clears the cache of compiled patterns.
+def purge():
+    _cache.clear()
+
 # Function: kmpMatch(needle, haystack)
 # Usage: print kmpMatch("0101", "0011001011") # Prints 5
 # -----------------------------------------------------------------------------
 # Uses the KMP algorithm to find an occurrence of the specified needle string
-# in the haystack string.  To do this, we compute the failure table, which
-# is done above.  Next, we iterate across the string, keeping track of a
-# candidate start point and length matched so far.  Whenever a match occurs, we
-# update the length of the match we've made.  On a failure, we update these
-# values by trying to preserve the maximum proper border of the string we were
-# able to manage by that point.
+# in the haystack string, returning the index where it starts or None if there
+# is no match.  See KMPPattern.search for the details.
 def kmpMatch(needle, haystack):
-    # Compute the failure table for the needle we're looking up.
-    fail = failTable(needle)
-
-    # Keep track of the start index and next match position, both of which
-    # start at zero since our candidate match is at the beginning and is trying
-    # to match the first character.
-    index = 0
-    match = 0
-
-    # Loop until we fall off the string or match.
-    while index + match < len(haystack):
-        print index, match
-
-        # If the current character matches the expected character, then bump up
-        # the match index.
-        if haystack[index + match] == needle[match]:
-            match = match + 1
-
-            # If we completely matched everything, we're done.
-            if match == len(needle):
-                return index
-
-        # Otherwise, we need to look at the fail table to determine what to do
-        # next.
+    return compile(needle).search(haystack)
+
+# Function: kmpFinditer(needle, chunks, chunkSize = 65536)
+# Usage: for offset in kmpFinditer("ERROR", open("server.log")): ...
+# -----------------------------------------------------------------------------
+# Yields the offset of every occurrence of the needle in a haystack given as an
+# iterable of chunks or a file-like object.  See KMPPattern.finditer for the
+# details.
+def kmpFinditer(needle, chunks, chunkSize = 65536):
+    return compile(needle).finditer(chunks, chunkSize)
+
+# Class: AhoCorasick
+# Usage: matcher = AhoCorasick(["he", "she", "hers"])
+#        for patternId, offset in matcher.finditer(["ushers"]): ...
+# -----------------------------------------------------------------------------
+# A matcher that searches for many needles at once using the Aho-Corasick
+# algorithm, which is the natural generalization of KMP from one pattern to a
+# whole set of them.  Running kmpMatch once per needle costs O(k |T|) time for
+# k needles, while Aho-Corasick makes a single pass over the haystack and runs
+# in O(|P| + |T| + z) time, where |P| is the total length of the needles and z
+# is the number of matches reported.
+#
+# In KMP, the state of the matcher is the length of the prefix of the needle
+# matched so far, and the failure table maps each prefix to its longest proper
+# border.  With many needles, we instead store all of the needles in a trie, so
+# that each node of the trie is a prefix of at least one needle, and the state
+# of the matcher is the node for the longest such prefix that is a suffix of
+# what we've read so far.  The failure link of a node is then the node for the
+# longest proper suffix of its string that is also in the trie.  This is
+# exactly the border from before, except that the suffix is allowed to be a
+# prefix of a different needle.
+#
+# The failure links are computed with the same recurrence as failTable.  To
+# find the failure link of the child of node u along character c, we walk the
+# failure links from u until we find a node that has a child along c (or we
+# reach the root), and that child is the answer.  Since this needs the failure
+# links of shorter strings, we visit the trie in breadth-first order.  The same
+# potential argument as for failTable shows that this takes time linear in the
+# total length of the needles.
+#
+# One new wrinkle is that a node may complete several needles at once, since
+# some needles may be suffixes of others (for example, "she" ends with "he").
+# To report these quickly, each node also stores an output link pointing to the
+# nearest node along its chain of failure links that completes some needle.
+# Following output links then visits only nodes that produce matches.
+class AhoCorasick:
+    def __init__(self, needles):
+        """Builds the matching automaton for the given list of needles.  The
+        needles are identified in the results by their index in this list."""
+        self.needles = list(needles)
+        self.lengths = [len(needle) for needle in self.needles]
+
+        # The trie, with one dictionary of children per node, and for each node
+        # the indices of the needles that end there.  Node 0 is the root.
+        self.children = [{}]
+        self.outputs = [[]]
+
+        for patternId, needle in enumerate(self.needles):
+            node = 0
+            for char in needle:
+                child = self.children[node].get(char)
+                if child is None:
+                    child = len(self.children)
+                    self.children[node][char] = child
+                    self.children.append({})
+                    self.outputs.append([])
+                node = child
+            self.outputs[node].append(patternId)
+
+        # The failure and output links, filled in breadth-first order.  An
+        # output link of -1 means there are no more matches along the chain.
+        self.fail = [0] * len(self.children)
+        self.outputLink = [-1] * len(self.children)
+
+        queue = deque([0])
+        while queue:
+            node = queue.popleft()
+            for char, child in self.children[node].items():
+                queue.append(child)
+
+                # Children of the root fall back to the root itself.
+                if node == 0:
+                    back = 0
+
+                # Otherwise, walk the failure links from the parent until we
+                # find a node that can be extended by this character.
+                else:
+                    back = self.fail[node]
+                    while back != 0 and char not in self.children[back]:
+                        back = self.fail[back]
+                    back = self.children[back].get(char, 0)
+
+                self.fail[child] = back
+                if self.outputs[back]:
+                    self.outputLink[child] = back
+                else:
+                    self.outputLink[child] = self.outputLink[back]
+
+    # Function: finditer(chunks, chunkSize = 65536)
+    # Usage: for patternId, offset in matcher.finditer(open("doc.txt")): ...
+    # -------------------------------------------------------------------------
+    # A generator that finds every occurrence of every needle in a haystack
+    # handed to us in pieces, exactly as KMPPattern.finditer does for a single
+    # needle, yielding (patternId, offset) pairs.  Matches are reported in
+    # order of the position where they end; matches ending at the same
+    # position are reported longest first.
+    def finditer(self, chunks, chunkSize = 65536):
+        children = self.children
+        outputs = self.outputs
+        fail = self.fail
+        outputLink = self.outputLink
+        lengths = self.lengths
+
+        # Empty needles match before the first character.
+        for patternId in outputs[0]:
+            yield (patternId, 0)
+
+        offset = 0
+        state = 0
+        for chunk in readChunks(chunks, chunkSize):
+            for i, char in enumerate(chunk):
+                # Fall back through the failure links until some node can be
+                # extended by this character, then extend it.
+                while state != 0 and char not in children[state]:
+                    state = fail[state]
+                state = children[state].get(char, 0)
+
+                # Report every needle ending here by walking the output links.
+                end = offset + i + 1
+                node = state if outputs[state] else outputLink[state]
+                while node != -1:
+                    for patternId in outputs[node]:
+                        yield (patternId, end - lengths[patternId])
+                    node = outputLink[node]
+
+            offset = offset + len(chunk)
+
+# Function: kmpFinditerMany(needles, chunks, chunkSize = 65536)
+# Usage: for patternId, offset in kmpFinditerMany(["he", "she"], ["ushers"]):
+# -----------------------------------------------------------------------------
+# Yields a (patternId, offset) pair for every occurrence of every needle in a
+# haystack given as an iterable of chunks or a file-like object, where
+# patternId is the index of the needle in the list.  See AhoCorasick for the
+# details.
+def kmpFinditerMany(needles, chunks, chunkSize = 65536):
+    return AhoCorasick(needles).finditer(chunks, chunkSize)
+
+# Function: kmpFileFinditer(needle, path, chunkSize = 1 << 20)
+# Usage: for offset in kmpFileFinditer(b"ERROR", "server.log"): ...
+# -----------------------------------------------------------------------------
+# Yields the file offset of every occurrence of the given bytes needle in the
+# file at the given path.  Rather than reading the file into memory, we map it
+# into our address space and scan it in place, so the operating system pages
+# the file in (and out again) as the search moves along.
+def kmpFileFinditer(needle, path, chunkSize = 1 << 20):
+    with open(path, "rb") as source:
+        # Empty files can't be memory-mapped, but there's nothing to scan.
+        if os.fstat(source.fileno()).st_size == 0:
+            mapping = None
+            haystack = b""
         else:
-            # If we couldn't match the first character, then just advance the
-            # start index.  We need to try again.
-            if match == 0:
-                index = index + 1
+            mapping = mmap.mmap(source.fileno(), 0, access = mmap.ACCESS_READ)
+            haystack = mapping
+
+    matches = compile(needle).finditer(haystack, chunkSize)
+    try:
+        for offset in matches:
+            yield offset
+
+    # Shut down the search before unmapping the file, since the search holds
+    # views into the mapping that must be released first.
+    finally:
+        matches.close()
+        if mapping is not None:
+            mapping.close()
+
+# Function: kmpParallelFinditer(needle, path, processes = None,
+#                               shardSize = 1 << 26)
+# Usage: for offset in kmpParallelFinditer(b"ERROR", "server.log"): ...
+# -----------------------------------------------------------------------------
+# Yields the file offset of every occurrence of the given bytes needle in the
+# file at the given path, exactly as kmpFileFinditer does, but splits the work
+# across a pool of worker processes (by default, one per CPU).
+#
+# The file is cut into shards of shardSize bytes, and each worker memory-maps
+# the file and scans one shard at a time.  A match that starts near the end of
+# one shard may run over into the next one, so each worker actually scans
+# len(needle) - 1 bytes past the end of its shard.  That overlap means the same
+# match could be found by two neighboring workers, so to avoid duplicates each
+# worker only reports the matches that start inside its own shard.  Every match
+# starts in exactly one shard, so concatenating the shards' results in order
+# gives exactly the sequence of offsets the sequential search would produce.
+def kmpParallelFinditer(needle, path, processes = None, shardSize = 1 << 26):
+    size = os.path.getsize(path)
+    overlap = max(len(needle) - 1, 0)
+    shards = [(needle, path, start, min(start + shardSize, size),
+               min(start + shardSize + overlap, size))
+              for start in range(0, size, shardSize)]
 
-            # Otherwise, see how much we need to skip forward before we have
-            # another feasible match.
+    # The empty needle also matches at the very end of the file, which isn't
+    # the start of any shard.
+    if len(needle) == 0:
+        shards.append((needle, path, size, size + 1, size))
+
+    # There's no point starting up a pool for a single shard.
+    if len(shards) <= 1 or processes == 1:
+        for shard in shards:
+            for offset in searchShard(shard):
+                yield offset
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        # imap hands back each shard's results in order, while letting the
+        # workers run ahead on later shards.
+        for offsets in pool.imap(searchShard, shards):
+            for offset in offsets:
+                yield offset
+    finally:
+        pool.terminate()
+        pool.join()
+
+# Function: searchShard(shard)
+# Usage: offsets = searchShard((needle, path, start, end, stop))
+# -----------------------------------------------------------------------------
+# The worker half of kmpParallelFinditer.  Given a needle and the path to a
+# file, memory-maps the file and returns a list of the offsets of the matches
+# that start in [start, end), scanning the bytes in [start, stop).
+def searchShard(shard):
+    needle, path, start, end, stop = shard
+    if stop <= start:
+        return [start] if len(needle) == 0 and start < end else []
+
+    with open(path, "rb") as source:
+        mapping = mmap.mmap(source.fileno(), 0, access = mmap.ACCESS_READ)
+
+    try:
+        region = memoryview(mapping)[start : stop]
+    except TypeError:
+        # Python 2's mmap objects only support the old buffer interface.
+        region = buffer(mapping, start, stop - start)
+
+    offsets = []
+    for offset in compile(needle).finditer([region]):
+        if start + offset < end:
+            offsets.append(start + offset)
+
+    # Release our view of the mapping so that it can be unmapped.
+    region = None
+    mapping.close()
+    return offsets
+
+# Function: readChunks(source, chunkSize)
+# Usage: for chunk in readChunks(open("server.log"), 4096): ...
+# -----------------------------------------------------------------------------
+# Given either a file-like object or an iterable of chunks, produces the chunks
+# of the haystack one at a time.  File-like objects (anything with a read
+# method) are read chunkSize elements at a time until they run dry.
+#
+# As a special case, a single bytes-like object (bytes, bytearray, memoryview,
+# or mmap.mmap) is treated as the whole haystack rather than as a sequence of
+# chunks, and is handed back as a series of views into the original buffer.
+# None of the haystack is ever copied, so scanning a memory-mapped file needs
+# only constant extra memory no matter how large the file is, and offsets
+# are measured from the start of the file.
+def readChunks(source, chunkSize):
+    # If this is a buffer, slice it into views of chunkSize bytes each.
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        try:
+            view = memoryview(source)
+        except TypeError:
+            # Python 2's mmap objects only support the old buffer interface.
+            view = None
+
+        for start in range(0, len(source), chunkSize):
+            if view is not None:
+                yield view[start : start + chunkSize]
             else:
-                index = index + match - fail[match]
-                match = fail[match]
+                yield buffer(source, start, chunkSize)
+
+    # If this is a file, keep reading until we get back an empty chunk.
+    elif hasattr(source, "read"):
+        while True:
+            chunk = source.read(chunkSize)
+            if len(chunk) == 0:
+                return
+            yield chunk
+
+    # Otherwise, it's already a sequence of chunks.
+    else:
+        for chunk in source:
+            yield chunk
+
+# Function: benchmarkDfa(size = 1 << 20, repeat = 3)
+# Usage: benchmarkDfa()
+# -----------------------------------------------------------------------------
+# Times finding every match of a needle in a haystack of the given size, once
+# with the failure-table matcher and once with the full automaton, printing and
+# returning the best time (in seconds) of each over several runs.  There are
+# two workloads: a short needle in random DNA, where mismatches rarely follow
+# more than one failure link, and a run of A's searched for A...AC, where every
+# character forces the failure-table matcher to retreat through several links.
+def benchmarkDfa(size = 1 << 20, repeat = 3):
+    generator = random.Random(137)
+    workloads = [
+        ("random DNA", b"GATTACA",
+         bytearray(generator.choice(b"ACGT") for i in range(size))),
+        ("repetitive", b"AAAAAAAAC", bytearray(b"A" * size)),
+    ]
+
+    results = []
+    for name, needle, haystack in workloads:
+        times = []
+        for pattern in (KMPPattern(needle), KMPDFAPattern(needle)):
+            best = None
+            for i in range(repeat):
+                start = time.time()
+                for offset in pattern.finditer([haystack]):
+                    pass
+                elapsed = time.time() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            times.append(best)
+
+        print("%s, %d bytes: failure table %.3fs, automaton %.3fs" %
+              (name, size, times[0], times[1]))
+        results.append((name, times[0], times[1]))
+
+    return results
+
+# Function: benchmarkParallel(size = 1 << 26, processes = None, repeat = 3)
+# Usage: benchmarkParallel()
+# -----------------------------------------------------------------------------
+# Writes a temporary file of random DNA of the given size, then times finding
+# every match of a needle in it with kmpFileFinditer and kmpParallelFinditer,
+# checking that both find the same matches.  Prints and returns the best time
+# (in seconds) of each over several runs.
+def benchmarkParallel(size = 1 << 26, processes = None, repeat = 3):
+    needle = b"GATTACA"
+    generator = random.Random(137)
+    handle, path = tempfile.mkstemp()
+    try:
+        with os.fdopen(handle, "wb") as target:
+            for start in range(0, size, 1 << 20):
+                length = min(1 << 20, size - start)
+                target.write(bytearray(generator.choice(b"ACGT")
+                                       for i in range(length)))
+
+        # Use several shards per process so that the pool stays busy.
+        workers = processes or multiprocessing.cpu_count()
+        shardSize = max(size // (4 * workers), 1)
+
+        times = []
+        results = []
+        for search in (lambda: kmpFileFinditer(needle, path),
+                       lambda: kmpParallelFinditer(needle, path, processes,
+                                                   shardSize)):
+            best = None
+            for i in range(repeat):
+                start = time.time()
+                offsets = list(search())
+                elapsed = time.time() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            times.append(best)
+            results.append(offsets)
+    finally:
+        os.remove(path)
 
-    # If we made it here, then no match was found.
-    return None
+    assert results[0] == results[1]
+    print("%d bytes, %d processes: sequential %.3fs, parallel %.3fs, "
+          "speedup %.2fx" % (size, workers, times[0], times[1],
+                             times[0] / times[1]))
+    return tuple(times)
@@ -52,6 +52,17 @@
 # above, this will run in O(m + n) time.  (Thanks to Prof. David Gries of
 # Cornell University for this solution).
 
+import bisect
+import mmap
+import struct
+
+# NumPy is only needed to answer many queries at once (see matrixFindMany
+# below); matrixFind itself works on any nested sequences.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # Function: matrixFind(matrix, value)
 # Usage: result = matrixFind(myMatrix, 137)
 # -----------------------------------------------------------------------------
@@ -92,3 +103,555 @@ def matrixFind(matrix, value):
             j = j - 1
 
     return False
+
+# Function: matrixLocate(matrix, value)
+# Usage: position = matrixLocate(myMatrix, 137)
+# -----------------------------------------------------------------------------
+# Just like matrixFind, but returns the (row, column) position at which the
+# value was found, or None if it isn't in the matrix.
+def matrixLocate(matrix, value):
+    m = len(matrix)
+    n = len(matrix[0]) if m > 0 else 0
+
+    i = 0
+    j = n - 1
+    while i < m and j >= 0:
+        entry = matrix[i][j]
+        if entry == value:
+            return (i, j)
+        elif entry < value:
+            i = i + 1
+        else:
+            j = j - 1
+
+    return None
+
+# When there are many values to look up in the same matrix, we can run all of
+# their searches side by side.  Each search is just a position (i, j) that
+# moves down or left at each step, so keeping every search's row and column in
+# a pair of NumPy arrays lets us take a step of all of them at once with a few
+# whole-array operations.  A search drops out as soon as it finds its value or
+# walks off the matrix, and after at most m + n steps every search has done
+# one or the other.
+
+# Function: matrixFindMany(matrix, values)
+# Usage: found, positions = matrixFindMany(myMatrix, numpy.array([7, 0, 137]))
+# -----------------------------------------------------------------------------
+# Searches the given 2-D NumPy array, which must have its rows and columns in
+# sorted order, for each of the given values.  Returns a boolean array saying
+# which of the values were found, along with an array of shape (len(values), 2)
+# holding the (row, column) position at which each was found (or (-1, -1) if
+# it wasn't).  Without NumPy, the matrix may be nested sequences, the values
+# are searched for one at a time, and the results are returned as lists.
+def matrixFindMany(matrix, values):
+    if numpy is None:
+        positions = [matrixLocate(matrix, value) for value in values]
+        return ([position is not None for position in positions],
+                [position or (-1, -1) for position in positions])
+
+    matrix = numpy.asarray(matrix)
+    values = numpy.asarray(values)
+    assert matrix.ndim == 2 and values.ndim == 1
+
+    found = numpy.zeros(len(values), dtype = bool)
+    positions = numpy.full((len(values), 2), -1, dtype = numpy.int64)
+    m, n = matrix.shape
+    if m == 0 or n == 0:
+        return found, positions
+
+    # 'active' holds the indices of the searches still running, and 'i' and
+    # 'j' their positions, starting at the end of the first row.
+    active = numpy.arange(len(values))
+    i = numpy.zeros(len(values), dtype = numpy.int64)
+    j = numpy.full(len(values), n - 1, dtype = numpy.int64)
+    while active.size > 0:
+        entries = matrix[i, j]
+        targets = values[active]
+
+        # Record the searches that found their values...
+        hit = entries == targets
+        found[active[hit]] = True
+        positions[active[hit], 0] = i[hit]
+        positions[active[hit], 1] = j[hit]
+
+        # ... then move each of the others down or left, and drop the ones
+        # that are done.
+        below = entries < targets
+        i = i + below
+        j = j - (~below & ~hit)
+        live = ~hit & (i < m) & (j >= 0)
+        active, i, j = active[live], i[live], j[live]
+
+    return found, positions
+
+# matrixFind needs no preprocessing at all, but it pays O(m + n) time for each
+# lookup.  If the same matrix is going to be searched over and over again, it
+# can be worth spending some time up front building an index of its entries
+# that answers each lookup more quickly.  A MatrixIndex supports two kinds of
+# index:
+#
+#   "sorted": every entry of the matrix, sorted by value, alongside its
+#             position.  Building it takes O(mn log mn) time, and each lookup
+#             is a binary search taking O(log mn) time.
+#   "hash":   a dictionary mapping each value to its position.  Building it
+#             takes O(mn) expected time, and each lookup O(1) expected time,
+#             but it uses rather more memory.
+#
+# When new rows are appended to the bottom of the matrix, there's no need to
+# start over.  The hash index just adds the new entries, and the sorted index
+# sorts the new entries by themselves and then merges them into the old ones.
+# (Python's sort notices that the combined list is made of two sorted runs and
+# merges them in linear time.)  Appending k entries thus costs O(mn + k log k)
+# time rather than O((mn + k) log (mn + k)).
+class MatrixIndex:
+    def __init__(self, matrix, kind = "sorted"):
+        """Builds an index of the given kind over a matrix whose rows and
+        columns are in sorted order."""
+        if kind not in ("sorted", "hash"):
+            raise Exception("Unknown index kind", kind)
+
+        self.kind = kind
+        self.rows = 0
+        self.columns = None
+        self.lastRow = None
+
+        # The sorted index is a list of (value, row, column) triples in sorted
+        # order, along with a list of just the values to search; the hash
+        # index maps each value to the first position at which it appears.
+        self.entries = []
+        self.keys = []
+        self.positions = {}
+
+        self.appendRows(matrix)
+
+    def __len__(self):
+        """Returns the number of entries in the indexed matrix."""
+        return self.rows * (self.columns or 0)
+
+    def __contains__(self, value):
+        """Returns whether the value appears in the indexed matrix."""
+        return self.locate(value) is not None
+
+    def find(self, value):
+        """Returns whether the value appears in the indexed matrix."""
+        return self.locate(value) is not None
+
+    def locate(self, value):
+        """Returns the (row, column) position of the value in the indexed
+        matrix, or None if it doesn't appear there.  If the value appears more
+        than once, the position with the smallest row (and then column) is
+        returned."""
+        if self.kind == "hash":
+            return self.positions.get(value)
+
+        index = bisect.bisect_left(self.keys, value)
+        if index == len(self.keys) or self.keys[index] != value:
+            return None
+        return self.entries[index][1:]
+
+    def appendRows(self, rows):
+        """Appends the given rows to the bottom of the indexed matrix, updating
+        the index.  Each row must be sorted and have the same length as the
+        others, and no entry may be smaller than the one above it."""
+        # Check the whole batch before touching the index, so that a bad row
+        # leaves the index just as it was.
+        columns = self.columns
+        lastRow = self.lastRow
+        count = self.rows
+        newEntries = []
+        for row in rows:
+            row = list(row)
+            if columns is None:
+                columns = len(row)
+            elif len(row) != columns:
+                raise Exception("Row has the wrong length", row)
+
+            for j in range(1, len(row)):
+                if row[j] < row[j - 1]:
+                    raise Exception("Row is not sorted", row)
+            if lastRow is not None:
+                for above, below in zip(lastRow, row):
+                    if below < above:
+                        raise Exception("Column is not sorted", row)
+
+            for j, value in enumerate(row):
+                newEntries.append((value, count, j))
+            lastRow = row
+            count = count + 1
+
+        self.columns = columns
+        self.lastRow = lastRow
+        self.rows = count
+
+        if self.kind == "hash":
+            for value, i, j in newEntries:
+                if value not in self.positions:
+                    self.positions[value] = (i, j)
+        else:
+            newEntries.sort()
+            self.entries = sorted(self.entries + newEntries)
+            self.keys = [entry[0] for entry in self.entries]
+
+# The staircase in matrixFind takes O(m + n) steps however lopsided the matrix
+# is, which is wasteful for something like a 10 x 10,000,000 matrix: it may
+# well spend millions of steps walking left along a single row.  We can do
+# better by noticing that the staircase visits each row in turn, and in each
+# row it's really just looking for the boundary between the entries smaller
+# than the value and the rest.  That boundary never moves right as we go down
+# the rows, since the columns are sorted.  So instead of walking left from the
+# previous row's boundary one step at a time, we gallop: we look 1, 2, 4, 8,
+# ... steps to the left until we pass the boundary, then binary search between
+# the last two places we looked.  If the boundary moves d steps, this takes
+# O(log (d + 1)) time rather than O(d + 1).  The boundary moves at most n steps
+# in total over the m rows, and since the logarithm is concave the total time
+# is greatest when every row moves it the same distance, giving O(m log (n/m))
+# time overall.  If the matrix is taller than it is wide, we do the same thing
+# with the rows and columns swapped.
+#
+# The boundary in each row also tells us how many of that row's entries are
+# smaller than the value (or, if we look for the boundary between the entries
+# no larger than the value and the rest, how many are at most the value), so
+# adding up the boundaries gives the rank of the value in the matrix in the
+# same time.
+
+# The ratio between the long and short dimensions of a matrix above which
+# matrixFindAdaptive gallops rather than using the plain staircase.
+GALLOP_RATIO = 4
+
+# Function: staircaseBoundaries(matrix, value, inclusive)
+# Usage: for count in staircaseBoundaries(myMatrix, 137, False): ...
+# -----------------------------------------------------------------------------
+# Given a matrix whose rows and columns are in sorted order, yields a pair
+# (line, count) for each line of the matrix along its shorter dimension (its
+# rows if it's at least as wide as it is tall, and its columns otherwise),
+# where count is the number of entries in that line smaller than the value
+# (or, if 'inclusive' is set, no larger than it).
+def staircaseBoundaries(matrix, value, inclusive):
+    m = len(matrix)
+    n = len(matrix[0]) if m > 0 else 0
+    if m == 0 or n == 0:
+        return
+
+    # Look up entries by (line, position along the line).
+    if m <= n:
+        lines, length = m, n
+        entry = lambda line, k: matrix[line][k]
+    else:
+        lines, length = n, m
+        entry = lambda line, k: matrix[k][line]
+
+    if inclusive:
+        before = lambda line, k: entry(line, k) <= value
+    else:
+        before = lambda line, k: entry(line, k) < value
+
+    bound = length
+    for line in range(lines):
+        # Once the boundary reaches the start of a line, it stays there.
+        if bound == 0:
+            yield line, 0
+            continue
+
+        # If the last entry before the old boundary is still in front of the
+        # new one, the boundary hasn't moved.
+        if before(line, bound - 1):
+            yield line, bound
+            continue
+
+        # Otherwise, gallop left from the old boundary until we find an entry
+        # in front of the new boundary (or run off the start of the line),
+        # then binary search between that and the last entry we looked at.
+        behind = bound - 1
+        step = 1
+        ahead = -1
+        while behind - step >= 0:
+            if before(line, behind - step):
+                ahead = behind - step
+                break
+            behind = behind - step
+            step = step * 2
+
+        while behind - ahead > 1:
+            middle = (ahead + behind) // 2
+            if before(line, middle):
+                ahead = middle
+            else:
+                behind = middle
+
+        bound = ahead + 1
+        yield line, bound
+
+# Function: gallopLocate(matrix, value)
+# Usage: position = gallopLocate(myMatrix, 137)
+# -----------------------------------------------------------------------------
+# Searches the given matrix, which must have its rows and columns in sorted
+# order, for the given value in O(m log (n/m)) time (where m is the shorter
+# dimension and n the longer), returning the (row, column) position at which
+# it was found or None if it isn't in the matrix.
+def gallopLocate(matrix, value):
+    m = len(matrix)
+    n = len(matrix[0]) if m > 0 else 0
+
+    # The first entry at or after each line's boundary is the first one that
+    # isn't smaller than the value, so it's the only one that could equal it.
+    for line, count in staircaseBoundaries(matrix, value, False):
+        if m <= n and count < n and matrix[line][count] == value:
+            return (line, count)
+        if m > n and count < m and matrix[count][line] == value:
+            return (count, line)
+
+    return None
+
+# Function: matrixFindAdaptive(matrix, value)
+# Usage: result = matrixFindAdaptive(myMatrix, 137)
+# -----------------------------------------------------------------------------
+# Just like matrixFind, but uses gallopLocate instead if one dimension of the
+# matrix is at least GALLOP_RATIO times the other.
+def matrixFindAdaptive(matrix, value):
+    m = len(matrix)
+    n = len(matrix[0]) if m > 0 else 0
+    if max(m, n) >= GALLOP_RATIO * min(m, n):
+        return gallopLocate(matrix, value) is not None
+    return matrixFind(matrix, value)
+
+# Function: matrixCount(matrix, value)
+# Usage: count = matrixCount(myMatrix, 137)
+# -----------------------------------------------------------------------------
+# Returns how many entries of the given matrix, which must have its rows and
+# columns in sorted order, are no larger than the value.
+def matrixCount(matrix, value):
+    return sum(count for line, count in
+               staircaseBoundaries(matrix, value, True))
+
+# Function: matrixRank(matrix, value)
+# Usage: rank = matrixRank(myMatrix, 137)
+# -----------------------------------------------------------------------------
+# Returns how many entries of the given matrix, which must have its rows and
+# columns in sorted order, are smaller than the value.
+def matrixRank(matrix, value):
+    return sum(count for line, count in
+               staircaseBoundaries(matrix, value, False))
+
+# All of the searches above only ever look at individual entries of the matrix
+# through matrix[i][j], and never at more than a handful of them, so there's no
+# need for the matrix to be in memory at all.  A MappedMatrix presents a file
+# (or a NumPy memmap, or any other buffer) holding a matrix of fixed-width
+# numbers in row-major order as a matrix that the searches can use directly,
+# reading just the entries they ask for out of a memory mapping.  It counts
+# the entries read, the distinct pages they came from, and how often a read
+# lands on a different page than the read before it, which together show how
+# much I/O a search costs.
+#
+# In a row-major file each row is contiguous, so moving left along a row
+# stays on the same page most of the time, but every step down a column lands
+# on a different page.  The staircase in matrixFind can take up to m steps
+# down, touching a new page on every one.  blockLocate instead gallops (as in
+# staircaseBoundaries) in both directions: whenever the staircase would move
+# down, it looks 1, 2, 4, ... rows further down the column and then binary
+# searches for the row where the staircase would stop going down, and
+# likewise when it would move left.  A run of d steps down thus touches only
+# O(log (d + 1)) pages instead of d, and the runs along rows touch few pages
+# since they stay within one row.
+
+# A single row of a MappedMatrix, as returned by matrix[i].
+class MappedRow:
+    def __init__(self, matrix, row):
+        """Creates a view of the given row of a MappedMatrix."""
+        self.matrix = matrix
+        self.row = row
+
+    def __len__(self):
+        """Returns the number of entries in the row."""
+        return self.matrix.columns
+
+    def __getitem__(self, column):
+        """Returns the entry in the given column of the row."""
+        return self.matrix.entry(self.row, column)
+
+class MappedMatrix:
+    def __init__(self, source, typecode = None, shape = None, offset = 0):
+        """Creates a view of the matrix of the given (rows, columns) shape,
+        whose entries are numbers of the given struct typecode in native
+        byte order, stored in row-major order starting 'offset' bytes into
+        'source.'  The source may be the path to a file, which is mapped
+        read-only until the view is closed, or a buffer such as an mmap.  It
+        may also be a 2-D NumPy memmap, in which case the typecode and shape
+        default to the memmap's own."""
+        self.file = None
+        self.mapping = source
+        if isinstance(source, str):
+            self.file = open(source, "rb")
+            self.mapping = mmap.mmap(self.file.fileno(), 0,
+                                     access = mmap.ACCESS_READ)
+
+        if hasattr(source, "dtype"):
+            typecode = typecode or source.dtype.char
+            shape = shape or source.shape
+        if typecode is None or shape is None:
+            raise Exception("Matrix typecode and shape are required")
+
+        self.typecode = typecode
+        self.itemsize = struct.calcsize(typecode)
+        self.rows, self.columns = shape
+        self.offset = offset
+        self.pageSize = mmap.PAGESIZE
+
+        # Read through a typed memoryview where we can, and otherwise (as on
+        # Python 2) unpack each entry by hand.
+        size = self.rows * self.columns * self.itemsize
+        try:
+            self.view = memoryview(self.mapping).cast("B")[
+                offset : offset + size].cast(typecode)
+        except (AttributeError, TypeError):
+            self.view = None
+
+        self.resetCounters()
+
+    def __len__(self):
+        """Returns the number of rows in the matrix."""
+        return self.rows
+
+    def __getitem__(self, row):
+        """Returns a view of the given row of the matrix."""
+        if not 0 <= row < self.rows:
+            raise IndexError("MappedMatrix row out of range", row)
+        return MappedRow(self, row)
+
+    def entry(self, row, column):
+        """Returns the entry at the given row and column, recording the
+        read."""
+        if not 0 <= column < self.columns:
+            raise IndexError("MappedMatrix column out of range", column)
+
+        index = row * self.columns + column
+        position = self.offset + index * self.itemsize
+        page = position // self.pageSize
+
+        self.reads = self.reads + 1
+        self.pages.add(page)
+        if page != self.lastPage:
+            self.pageSwitches = self.pageSwitches + 1
+            self.lastPage = page
+
+        if self.view is not None:
+            return self.view[index]
+        return struct.unpack_from(self.typecode, self.mapping, position)[0]
+
+    def pagesTouched(self):
+        """Returns the number of distinct pages that reads have come from."""
+        return len(self.pages)
+
+    def resetCounters(self):
+        """Resets the read, page, and page switch counts to zero."""
+        self.reads = 0
+        self.pages = set()
+        self.pageSwitches = 0
+        self.lastPage = None
+
+    def close(self):
+        """Releases the view and, if the view mapped a file itself, unmaps and
+        closes it."""
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.file is not None:
+            self.mapping.close()
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+# Function: blockLocate(matrix, value)
+# Usage: position = blockLocate(myMatrix, 137)
+# -----------------------------------------------------------------------------
+# Searches the given matrix, which must have its rows and columns in sorted
+# order, for the given value by galloping along the staircase, returning the
+# (row, column) position at which it was found or None if it isn't in the
+# matrix.
+def blockLocate(matrix, value):
+    m = len(matrix)
+    n = len(matrix[0]) if m > 0 else 0
+
+    i = 0
+    j = n - 1
+    while i < m and j >= 0:
+        entry = matrix[i][j]
+        if entry == value:
+            return (i, j)
+
+        if entry > value:
+            # Gallop left along row i for the last entry no larger than the
+            # value, keeping row[behind] > value and row[ahead] <= value (with
+            # ahead = -1 meaning that there's no such entry).
+            row = matrix[i]
+            behind = j
+            ahead = -1
+            step = 1
+            while behind - step >= 0:
+                if row[behind - step] <= value:
+                    ahead = behind - step
+                    break
+                behind = behind - step
+                step = step * 2
+            while behind - ahead > 1:
+                middle = (ahead + behind) // 2
+                if row[middle] <= value:
+                    ahead = middle
+                else:
+                    behind = middle
+
+            # If everything left in the row is too big, so is everything
+            # below it.  Otherwise, either we've found the value, or the rest
+            # of this row is too small.
+            if ahead < 0:
+                return None
+            if row[ahead] == value:
+                return (i, ahead)
+            i = i + 1
+            j = ahead
+        else:
+            # Gallop down column j for the first entry at least as large as
+            # the value, keeping matrix[above][j] < value and
+            # matrix[below][j] >= value (with below = m meaning that there's
+            # no such entry).
+            above = i
+            below = m
+            step = 1
+            while above + step < m:
+                if matrix[above + step][j] >= value:
+                    below = above + step
+                    break
+                above = above + step
+                step = step * 2
+            while below - above > 1:
+                middle = (above + below) // 2
+                if matrix[middle][j] < value:
+                    above = middle
+                else:
+                    below = middle
+            i = below
+
+    return None
+
+# Function: matrixFindFile(path, typecode, shape, value, offset = 0,
+#                          blockAware = True)
+# Usage: found, reads, pages = matrixFindFile("matrix.bin", "i", (m, n), 137)
+# -----------------------------------------------------------------------------
+# Searches a matrix of the given shape stored in row-major order in the file
+# at the given path, as numbers of the given struct typecode starting 'offset'
+# bytes in, for the given value without loading the file into memory.  Uses
+# blockLocate if 'blockAware' is set and the plain staircase of matrixFind
+# otherwise.  Returns whether the value was found along with the number of
+# entries read and the number of distinct pages touched.
+def matrixFindFile(path, typecode, shape, value, offset = 0,
+                   blockAware = True):
+    with MappedMatrix(path, typecode, shape, offset) as matrix:
+        if blockAware:
+            found = blockLocate(matrix, value) is not None
+        else:
+            found = matrixFind(matrix, value)
+        return found, matrix.reads, matrix.pagesTouched()
@@ -28,6 +28,12 @@
 # facility to generate permutations one at a time.  That way, we can use the
 # recursive strategy to generate permutations, but only run the recursion as
 # much as is needed.
+#
+# The recursive generator is not especially efficient, though.  Every level of
+# the recursion builds two new lists, and each permutation it produces has to
+# be handed up through a chain of n nested generators to reach the caller.
+# iterPermutations, at the bottom of this file, produces the same sequence of
+# permutations iteratively, by rearranging a single list in place.
 
 # Function: permutations(elems)
 # Usage: for p in permutations([1, 2, 3]): ...
@@ -36,11 +42,10 @@
 # If the input contains duplicates, then some permutations may be visited with
 # multiplicity greater than one.
 def permutations(elems):
-    # Our recursive algorithm requires two pieces of information, the elements
-    # that have not yet been permuted and the partial permutation built up so
-    # far.  We thus phrase this function as a wrapper around a recursive
-    # function with extra parameters.
-    for perm in recPermutations(elems, []):
+    # The recursive algorithm below is the simplest way to see what's going
+    # on, but iterPermutations produces exactly the same permutations in the
+    # same order with much less work, so we use that.
+    for perm in iterPermutations(elems):
         yield perm
 
 # A helper function to recursively generate permutations.  The function takes
@@ -64,3 +69,76 @@ def recPermutations(elems, soFar):
             for perm in recPermutations(elems[0:i] + elems[i+1:], 
                                         soFar + [elems[i]]):
                 yield perm
+
+# Notice that the recursive procedure above lists the permutations in
+# lexicographic order, if we think of each permutation as the sequence of
+# positions in the input that its elements came from.  For example, given
+# [a, b, c], it produces abc, acb, bac, bca, cab, and cba, which correspond to
+# the position sequences 012, 021, 102, 120, 201, and 210.  So we can produce
+# the same sequence iteratively by starting with the positions in order and
+# repeatedly stepping to the next permutation in lexicographic order, which is
+# done as follows:
+#
+#   1. Find the largest k with p[k] < p[k + 1].  If there is none, the
+#      positions are in decreasing order, which is the last permutation.
+#   2. Find the largest l > k with p[k] < p[l].
+#   3. Swap p[k] and p[l], then reverse p[k + 1], ..., p[n - 1].
+#
+# Each step takes O(n) time in the worst case, but only O(1) amortized time,
+# since the suffix that gets reversed is usually short.  By applying the same
+# swaps and reversals to a list of the elements themselves, we keep the
+# elements in the order given by the positions without ever having to compare
+# them, so this works for elements of any type, and repeated elements are
+# visited with multiplicity just as in the recursive version.
+
+# Function: iterPermutations(elems, mode = "copy")
+# Usage: for p in iterPermutations([1, 2, 3], "shared"): ...
+# -----------------------------------------------------------------------------
+# A generator function that generates all permutations of the input elements,
+# in the same order as permutations(), by permuting a single list in place.
+# The mode says how each permutation is handed back:
+#
+#   "copy":   as a new list, which the caller is free to keep or modify.
+#   "tuple":  as a new tuple.
+#   "shared": as the list that the generator is permuting, which involves no
+#             allocation at all.  The caller must not modify it, and must copy
+#             it to keep it, since it changes as soon as the generator resumes.
+def iterPermutations(elems, mode = "copy"):
+    if mode not in ("copy", "tuple", "shared"):
+        raise Exception("Unknown mode", mode)
+
+    buffer = list(elems)
+    positions = list(range(len(buffer)))
+    n = len(buffer)
+
+    while True:
+        if mode == "shared":
+            yield buffer
+        elif mode == "tuple":
+            yield tuple(buffer)
+        else:
+            yield list(buffer)
+
+        # Find the largest k with positions[k] < positions[k + 1].  If there
+        # isn't one, we've just produced the last permutation.
+        k = n - 2
+        while k >= 0 and positions[k] > positions[k + 1]:
+            k = k - 1
+        if k < 0:
+            return
+
+        # Find the largest l with positions[k] < positions[l], and swap.
+        l = n - 1
+        while positions[l] < positions[k]:
+            l = l - 1
+        positions[k], positions[l] = positions[l], positions[k]
+        buffer[k], buffer[l] = buffer[l], buffer[k]
+
+        # Reverse everything after k.
+        lo = k + 1
+        hi = n - 1
+        while lo < hi:
+            positions[lo], positions[hi] = positions[hi], positions[lo]
+            buffer[lo], buffer[hi] = buffer[hi], buffer[lo]
+            lo = lo + 1
+            hi = hi - 1